@@ -0,0 +1,532 @@
+import asyncio
+import json
+import logging
+import time
+import random
+import base64
+import threading
+import atexit
+import collections
+import functools
+import inspect
+import weakref
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from StashInterface import stash_interface_base, directoryPath, keyIsSet, normalizeTagName, graphQLOperationName
+
+#Asyncio Stash GraphQL Class.  The same methods as stash_interface, as coroutines, so many reads and non-conflicting writes can be in flight at once.
+#Use it with "async with async_stash_interface(...) as stash:", or await connect() before and close() after.  See sync_stash_interface to call it from blocking code
+class async_stash_interface(stash_interface_base):
+    auth = None
+
+    def __init__(self, server_url, user = "", pword = "", ignore_ssl = "", debug = False, pool_size = 10):
+        if aiohttp is None:
+            raise ImportError("The asyncio Stash client needs aiohttp.  Install it with 'pip install aiohttp'")
+        stash_interface_base.__init__(self, server_url, user, pword, ignore_ssl, debug)
+        self.pool_size = pool_size
+        self.locks = weakref.WeakValueDictionary()  # See __lock
+        self.write_tasks = set()  # Queued scene updates being sent in the background; see updateSceneData
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self):  # Opens the pooled session, authenticates and checks the Stash version
+        self.semaphore = asyncio.Semaphore(self.pool_size)  # At most pool_size calls to Stash at once; the rest wait their turn
+        connector = aiohttp.TCPConnector(limit=self.pool_size, ssl=False if self.ignore_ssl_warnings else None)
+        self.session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.CookieJar(unsafe=True))  # unsafe allows the jwt cookie when Stash is addressed by IP
+        await self.setAuth()
+        await self.checkVersion()
+        return self
+
+    async def close(self):  # Sends queued scene updates and closes the session
+        if self.session is None:
+            return
+        try:
+            await self.flushSceneUpdates()
+        finally:
+            await self.session.close()
+            self.session = None
+
+    async def setAuth(self):
+        async with self.session.get(self.server+"/playground") as r:
+            if len(r.history)>0 and r.history[-1].status == 302:
+                self.http_auth_type="jwt"
+            elif r.status == 200:
+                self.http_auth_type="none"
+            else:
+                self.http_auth_type="basic"
+                self.auth = aiohttp.BasicAuth(self.username, self.password)
+        if self.http_auth_type == "jwt": await self.jwtAuth()
+
+    async def jwtAuth(self):
+        async with self.session.post(self.server+"/login", data = {'username':self.username, 'password':self.password}) as response:
+            cookie = response.cookies.get('session', None)
+        self.auth_token = cookie.value if cookie else None
+        if not self.auth_token:
+            logging.error("Error authenticating with Stash.  Double check your IP, Port, Username, and Password", exc_info=self.debug_mode)
+            raise Exception("Stash authentication error")
+        self.session.cookie_jar.update_cookies({'session': self.auth_token})
+
+    def __lock(self, *key):  # An asyncio.Lock per key (e.g. a scene ID), so conflicting work is serialized while everything else runs concurrently.  Unused locks are dropped
+        lock = self.locks.get(key, None)
+        if lock is None:
+            lock = asyncio.Lock()
+            self.locks[key] = lock
+        return lock
+
+    #GraphQL Functions
+    async def callGraphQL(self, query, variables = None):
+        if "mutation" in query and self.idle_checks_enabled: await self.waitForIdle(self.idle_ttl) #Check that the DB is not locked
+        call = {'request_bytes': 0, 'response_bytes': 0, 'retries': 0}
+        started = time.time()
+        failed = True
+        try:
+            result = await self.__callGraphQL(query, variables, call)
+            failed = False
+        finally:
+            self.recordCall(graphQLOperationName(query), time.time() - started, call, failed)
+        if "mutation" in query and "metadata" in query: self.idle_checked_at = 0  #We just started a job, so the cached Idle status is stale
+        return result
+
+    async def __callGraphQL(self, query, variables, call, retry = True):
+        graphql_server = self.server+"/graphql"
+        payload = {}
+        payload['query'] = query
+        if variables:
+            payload['variables'] = variables
+        body = json.dumps(payload).encode('utf-8')
+
+        started = time.time()
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:  # Released while we wait to retry
+                    async with self.session.post(graphql_server, data=body, headers=self.headers, auth=self.auth) as response:
+                        status = response.status
+                        content = await response.read()
+                        retry_after_header = response.headers.get("Retry-After", None)
+                call['request_bytes'] = call['request_bytes'] + len(body)
+                call['response_bytes'] = call['response_bytes'] + len(content)
+                action, value = self.handleResponse(query, variables, status, json.loads(content) if status == 200 else None, attempt, retry_after_header, retry)
+                if action == 'done':
+                    return value
+                if action == 'reauth':
+                    await self.jwtAuth()
+                    retry = False
+                    continue
+                retry_after = value
+            except aiohttp.ClientSSLError:
+                logging.error("Caught certificate error trying to talk to Stash. Add ignore_ssl_warnings=True to your configuration.py to ignore it.", exc_info=self.debug_mode)
+                raise
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                retry_after = self.connectionRetryDelay(query, attempt)
+                if retry_after is None:
+                    raise
+
+            self.startRetry(query, variables, started, attempt, retry_after)
+            await asyncio.sleep(retry_after)
+            attempt = attempt + 1
+            call['retries'] = attempt
+
+    async def waitForIdle(self, max_age = 0, max_wait = None):  # Returns True once Stash is Idle.  Concurrent callers share a single poll
+        if time.time() - self.idle_checked_at < max_age:
+            return True
+        async with self.__lock('idle'):
+            if max_age and time.time() - self.idle_checked_at < max_age:  # Another call saw Idle while we waited
+                return True
+            started = time.time()
+            delay = self.idle_poll_min
+            while True:
+                jobStatus = await self.getStatus()
+                if jobStatus['status']=="Idle":
+                    self.idle_checked_at = time.time()
+                    return True
+                if max_wait is not None and time.time() - started >= max_wait:
+                    logging.warning("Stash is still busy after "+str(max_wait)+" seconds.  Status:"+jobStatus['status'])
+                    return False
+                sleep_time = delay + random.uniform(0, delay / 2)  #Jitter, so several scripts don't poll in lockstep
+                print("Stash is busy.  Retrying in {:.0f} seconds.  Status:".format(sleep_time)+jobStatus['status']+"; Progress:"+'{:.0%}'.format(jobStatus['progress'] or 0))
+                await asyncio.sleep(sleep_time)
+                delay = min(delay * 2, self.idle_poll_max)
+
+    async def getStatus(self):
+        result = await self.callGraphQL("{ jobStatus{ progress status message } }")
+        return result["data"]["jobStatus"]
+
+    async def scan(self, useFileMetadata = False, path = False):
+        variables = {'input': {'useFileMetadata': useFileMetadata}}
+        if path:
+            variables['input']['paths'] = path
+        await self.callGraphQL("mutation metadataScan($input:ScanMetadataInput!) { metadataScan(input: $input) }", variables)
+
+    async def clean(self):
+        await self.callGraphQL("mutation metadataClean{ metadataClean }")
+
+    async def generate(self, generateInput = None, scene_ids = None, paths = None):  # See stash_interface.generate
+        variables = generateInput or {'input': {'sprites': True, 'previews': True, 'imagePreviews': False, 'markers': True, 'transcodes': False}}
+        if scene_ids is not None or paths is not None:
+            scene_ids = list(scene_ids or [])
+            for path in paths or []:
+                scene_ids.extend(await self.getSceneIDsByPath(path))
+            variables = self.scopeJobInput(variables, 'sceneIDs', scene_ids, await self.getInputFields("GenerateMetadataInput"))
+            if variables is None:
+                return
+        await self.callGraphQL("mutation metadataGenerate($input:GenerateMetadataInput!) { metadataGenerate(input: $input) }", variables)
+
+    async def autoTag(self, autoTagInput = None, scene_ids = None, paths = None):  # See stash_interface.autoTag
+        variables = autoTagInput or {'input': {'performers': ['*'], 'studios': ['*'], 'tags': ['*']}}
+        if scene_ids is not None or paths is not None:
+            paths = list(paths or [])
+            if scene_ids:
+                paths.extend([scene["path"] async for scene in self.iterScenes(scene_ids=[int(scene_id) for scene_id in scene_ids], fields="id path")])
+            variables = self.scopeJobInput(variables, 'paths', paths, await self.getInputFields("AutoTagMetadataInput"))
+            if variables is None:
+                return
+        await self.callGraphQL("mutation metadataAutoTag($input:AutoTagMetadataInput!) { metadataAutoTag(input: $input) }", variables)
+
+    async def getSceneIDsByPath(self, path):  # IDs of the scenes under the directory path
+        if 'path' in await self.getSceneFilterFields():
+            return [scene["id"] async for scene in self.iterScenes(path=path, fields="id")]
+        path = directoryPath(path)
+        return [scene["id"] async for scene in self.iterScenes(fields="id path") if path in scene["path"]]
+
+    async def checkVersion(self):
+        result = await self.callGraphQL("{ version{ version build_time } }")
+        if not self.checkBuildTime(result["data"]["version"]):
+            raise Exception("Stash version too old")
+
+    async def getInputFields(self, type_name):  # Names of the fields this Stash accepts in an input type, e.g. whether SceneFilterType supports AND/OR/NOT
+        if type_name not in self.input_fields:
+            try:
+                result = await self.callGraphQL("{ __type(name: \""+type_name+"\"){ inputFields { name } } }")
+                self.input_fields[type_name] = [field["name"] for field in result["data"]["__type"]["inputFields"]]
+            except Exception:
+                logging.warning("Could not read the fields of "+type_name+" supported by Stash", exc_info=self.debug_mode)
+                self.input_fields[type_name] = []
+        return self.input_fields[type_name]
+
+    async def getSceneFilterFields(self):
+        return await self.getInputFields("SceneFilterType")
+
+    #Cache Functions.  See stash_interface_base for the indexes and snapshot
+    async def populatePerformers(self):
+        fingerprint = await self.getFingerprint('performers')
+        result = await self.callGraphQL("{ allPerformers{ id name aliases image_path } }")
+        self.setCollection('performers', result["data"]["allPerformers"], fingerprint)
+        self.saveSnapshot()
+
+    async def populateStudios(self):
+        fingerprint = await self.getFingerprint('studios')
+        result = await self.callGraphQL("{ allStudios{ id name url image_path } }")
+        self.setCollection('studios', result["data"]["allStudios"], fingerprint)
+        self.saveSnapshot()
+
+    async def populateTags(self):
+        fingerprint = await self.getFingerprint('tags')
+        result = await self.callGraphQL("{ allTags{ id name } }")
+        self.setCollection('tags', result["data"]["allTags"], fingerprint)
+        self.saveSnapshot()
+
+    async def loadCollection(self, collection):  # Makes sure 'performers', 'studios' or 'tags' are loaded.  Concurrent callers wait for a single download
+        if getattr(self, collection) is not None:
+            return
+        async with self.__lock('collection', collection):
+            if getattr(self, collection) is not None:
+                return
+            if self.hasSnapshot(collection):
+                fingerprint = await self.getFingerprint(collection)
+                if fingerprint is not None and self.restoreSnapshot(collection, fingerprint):
+                    return
+            if collection == 'performers': await self.populatePerformers()
+            elif collection == 'studios': await self.populateStudios()
+            elif collection == 'tags': await self.populateTags()
+
+    async def getCount(self, collection):  # Number of performers, studios or tags in Stash, without downloading them
+        find_query = self.collection_queries[collection]
+        result = await self.callGraphQL("{ "+find_query+"(filter: {per_page: 1}){ count } }")
+        return result["data"][find_query]["count"]
+
+    async def getFingerprints(self, collections):  # See stash_interface.getFingerprints
+        result = await self.callGraphQL(self.buildFingerprintQuery(collections))
+        return self.parseFingerprints(collections, result["data"])
+
+    async def getFingerprint(self, collection):  # None if Stash couldn't give us one
+        try:
+            return (await self.getFingerprints([collection]))[collection]
+        except Exception:
+            logging.warning("Could not get a fingerprint of "+collection+" from Stash", exc_info=self.debug_mode)
+            return None
+
+    async def reconcileCache(self):  # Compares the fingerprints of the cached lists with Stash and re-downloads the lists that differ, concurrently
+        loaded = [collection for collection in ('performers', 'studios', 'tags') if getattr(self, collection) is not None]
+        if not loaded:
+            return False
+        try:
+            fingerprints = await self.getFingerprints(loaded)
+            stale = [collection for collection in loaded if not self.isCurrent(collection, fingerprints[collection])]
+        except Exception:
+            logging.warning("Could not get fingerprints from Stash; reloading performers, studios, and tags", exc_info=self.debug_mode)
+            stale = loaded
+        populate = {'performers': self.populatePerformers, 'studios': self.populateStudios, 'tags': self.populateTags}
+        await asyncio.gather(*(populate[collection]() for collection in stale))
+        return len(stale) > 0
+
+    #Scene Functions
+    async def findScenes(self, **kwargs):
+        return [scene async for scene in self.iterScenes(**kwargs)]
+
+    async def iterScenes(self, **kwargs):  # Yields scenes as each page arrives, with up to prefetch pages requested concurrently.  See scene_pager for how paging copes with scenes updated along the way
+        prefetch = kwargs.get("prefetch", 0)
+        query, variables = self.buildFindScenes(kwargs)
+        pager = self.buildScenePager(kwargs, variables)
+        pending = collections.deque()  # (page, per_page, task) in page order
+        try:
+            while True:
+                if not pending:
+                    pending.append(self.__requestScenePage(query, variables, *pager.takePage()))
+                page, page_size, request = pending.popleft()
+                result, elapsed = await request
+                stashScenes = pager.readPage(page, page_size, result)
+                for scene in pager.newScenes(stashScenes):
+                    yield scene
+                if pager.reachedMax():
+                    return
+                if pager.pageDone(page, page_size, len(stashScenes) == 0, elapsed):
+                    self.__cancelRequests(pending)
+                if pager.isFinished(len(pending)):
+                    return
+
+                while len(pending) < prefetch and pager.canPrefetch():
+                    pending.append(self.__requestScenePage(query, variables, *pager.takePage()))
+        except Exception:
+            logging.error("Unexpected error getting stash scene:", exc_info=self.debug_mode)
+        finally:
+            self.__cancelRequests(pending)
+
+    def __requestScenePage(self, query, variables, page, per_page):  # Returns (page, per_page, task)
+        page_variables = dict(variables)
+        page_variables['filter'] = dict(variables['filter'], page=page, per_page=per_page)
+        return page, per_page, asyncio.ensure_future(self.__fetchScenePage(query, page_variables))
+
+    async def __fetchScenePage(self, query, variables):
+        start = time.time()
+        result = await self.callGraphQL(query, variables)
+        return result, time.time() - start
+
+    def __cancelRequests(self, pending):
+        for page, per_page, request in pending:
+            request.cancel()
+        pending.clear()
+
+    async def hydrateScene(self, scene):  # Returns the full data (SCENE_FIELDS) for a scene that was listed with fewer fields
+        return (await self.hydrateScenes([scene]))[0]
+
+    async def hydrateScenes(self, scenes):  # See stash_interface.hydrateScenes
+        scene_ids = [scene['id'] for scene in scenes if self.needsHydrating(scene)]
+        if not scene_ids:
+            return list(scenes)
+        return self.hydratedScenes(scenes, await self.callGraphQL(*self.buildHydrateScenes(scene_ids)))
+
+    def enableWriteBehind(self, batch_size = 50, max_delay = 30):  # Queue scene updates and send them batch_size at a time (or once the oldest has waited max_delay seconds) in a single request, without waiting for the result
+        self.scene_update_batch_size = batch_size
+        self.scene_update_max_delay = max_delay
+        self.scene_update_queue = []
+
+    async def updateSceneData(self, scene_data):
+        if self.scene_update_batch_size > 1:
+            self.scene_update_queue.append(scene_data)
+            if len(self.scene_update_queue) >= self.scene_update_batch_size or self.scene_update_max_delay <= 0:
+                self.__sendQueuedUpdates()
+            elif self.scene_update_timer is None:  # The first queued update starts the clock
+                self.scene_update_timer = asyncio.get_event_loop().call_later(self.scene_update_max_delay, self.__sendQueuedUpdates)
+            return
+        await self.__updateScene(scene_data)
+
+    def __sendQueuedUpdates(self):  # Starts sending the queue in the background
+        if self.scene_update_timer is not None:
+            self.scene_update_timer.cancel()
+            self.scene_update_timer = None
+        queue = self.scene_update_queue
+        self.scene_update_queue = []
+        if not queue:
+            return
+        task = asyncio.ensure_future(self.__sendSceneUpdates(queue))
+        self.write_tasks.add(task)
+        task.add_done_callback(self.write_tasks.discard)
+
+    async def updateScenes(self, scenes_data):  # Updates several scenes concurrently
+        await asyncio.gather(*(self.updateSceneData(scene_data) for scene_data in scenes_data))
+
+    async def __updateScene(self, scene_data):
+        async with self.__lock('scene', scene_data.get('id', None)):  # Updates to the same scene go out in the order they were made
+            await self.callGraphQL("mutation sceneUpdate($input:SceneUpdateInput!) { sceneUpdate(input: $input){ title } }", {'input': scene_data})
+
+    async def flushSceneUpdates(self):  # Sends queued scene updates, and waits for any batches already being sent
+        if self.scene_update_timer is not None:
+            self.scene_update_timer.cancel()
+            self.scene_update_timer = None
+        queue = self.scene_update_queue
+        self.scene_update_queue = []
+        if queue:
+            await self.__sendSceneUpdates(queue)
+        if self.write_tasks:
+            await asyncio.gather(*self.write_tasks)
+
+    async def __sendSceneUpdates(self, queue):
+        if len(queue) > 1:
+            query, variables = self.buildSceneUpdates(queue)
+            try:
+                result = await self.callGraphQL(query, variables)
+                self.logSceneUpdateErrors(queue, result)
+                return
+            except Exception:
+                logging.error("Error sending batch of "+str(len(queue))+" scene updates.  Retrying them one at a time.", exc_info=self.debug_mode)
+        results = await asyncio.gather(*(self.__updateScene(scene_data) for scene_data in queue), return_exceptions=True)
+        for scene_data, result in zip(queue, results):
+            if isinstance(result, Exception):
+                logging.error("Error updating scene "+str(scene_data.get("id", None))+": "+str(result))
+
+    #Performer, Studio and Tag Functions
+    async def addPerformer(self, performer_data):
+        result = None
+        update_data = performer_data
+        if update_data.get('aliases', None):
+            update_data['aliases'] = ', '.join(update_data['aliases'])
+        variables = {'input': update_data}
+        try:
+            result = await self.callGraphQL("mutation performerCreate($input:PerformerCreateInput!) { performerCreate(input: $input){ id name aliases image_path } }", variables)
+            self.cachePerformer(result["data"]["performerCreate"])
+            return result["data"]["performerCreate"]["id"]
+        except Exception:
+            logging.error("Error in adding performer", exc_info=self.debug_mode)
+            logging.error(variables)
+            logging.error(result)
+
+    async def addStudio(self, studio_data):
+        variables = {'input': studio_data}
+        try:
+            result = await self.callGraphQL("mutation studioCreate($input:StudioCreateInput!) { studioCreate(input: $input){ id name url image_path } }", variables)
+            self.cacheStudio(result["data"]["studioCreate"])
+            return result["data"]["studioCreate"]["id"]
+        except Exception:
+            logging.error("Error in adding studio:", exc_info=self.debug_mode)
+            logging.error(variables)
+
+    async def addTag(self, tag_data):
+        variables = {'input': tag_data}
+        try:
+            result = await self.callGraphQL("mutation tagCreate($input:TagCreateInput!) { tagCreate(input: $input){ id name } }", variables)
+            self.cacheTag(result["data"]["tagCreate"])
+            return result["data"]["tagCreate"]["id"]
+        except Exception:
+            logging.error("Error in adding tags", exc_info=self.debug_mode)
+            logging.error(variables)
+
+    async def updatePerformer(self, performer_data):
+        update_data = performer_data
+        if update_data.get('aliases', None):
+            update_data['aliases'] = ', '.join(update_data['aliases'])
+        if update_data.get('image_path', None):
+            update_data.pop('image_path',None)
+        async with self.__lock('performer', update_data.get('id', None)):
+            result = await self.callGraphQL("mutation performerUpdate($input:PerformerUpdateInput!) { performerUpdate(input: $input){ id name aliases image_path } }", {'input': update_data})
+        self.recachePerformer(result["data"]["performerUpdate"])
+        return result["data"]["performerUpdate"]
+
+    async def getPerformerImage(self, url):
+        async with self.session.get(url, proxy=self.proxies.get(url.split(':')[0], None), headers=self.headers) as response:
+            return base64.b64encode(await response.read())
+
+    async def scrapePerformerFreeones(self, name):
+        result = await self.callGraphQL('{ scrapePerformerList(scraper_id:"builtin_freeones", query:"'+name+'"){ name url twitter instagram birthdate ethnicity country eye_color height measurements fake_tits career_length tattoos piercings aliases } }')
+        variables = None
+        try:
+            if len(result['data']["scrapePerformerList"])!=0:
+                query = """
+                query ScrapePerformer($scraped_performer: ScrapedPerformerInput!){
+                    scrapePerformer(scraper_id:"builtin_freeones", scraped_performer: $scraped_performer)
+                    { url twitter instagram birthdate ethnicity country eye_color height measurements fake_tits career_length tattoos piercings aliases }
+                }"""
+                variables = {'scraped_performer': result['data']['scrapePerformerList'][0]}
+                result = await self.callGraphQL(query, variables)
+                if keyIsSet(result['data'], ['scrapePerformer', 'aliases']):
+                    result["data"]["scrapePerformer"]['aliases'] = [alias.strip() for alias in result["data"]["scrapePerformer"]['aliases'].split(',')]
+                return result["data"]["scrapePerformer"]
+            else:
+                return None
+        except Exception:
+            logging.error("Error in scraping Freeones", exc_info=self.debug_mode)
+            logging.error(variables)
+
+    async def getPerformerByName(self, name, aliases = []):
+        await self.loadCollection('performers')
+        return self.findCachedPerformer(name, aliases)
+
+    async def getStudioByName(self, name):
+        await self.loadCollection('studios')
+        return self.findCachedStudio(name)
+
+    async def getTagByName(self, name, add_tag_if_missing = False):
+        await self.loadCollection('tags')
+        tag = self.findCachedTag(name)
+        if tag or not add_tag_if_missing:
+            return tag
+
+        async with self.__lock('tag', normalizeTagName(name)):  # Concurrent callers asking for the same missing tag only add it once
+            tag = self.findCachedTag(name)
+            if tag:
+                return tag
+            print("Did not find " + name + " in Stash.  Adding Tag.")
+            await self.addTag({'name': name})
+            return self.findCachedTag(name)
+
+#Sync Facade.  Runs an async_stash_interface on an event loop in a background thread, so blocking code (like scrapeScenes) can use it in place of stash_interface
+class sync_stash_interface:
+    def __init__(self, server_url, user = "", pword = "", ignore_ssl = "", debug = False, pool_size = 10):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.client = async_stash_interface(server_url, user, pword, ignore_ssl, debug, pool_size)
+        self.run(self.client.connect())
+        atexit.register(self.close)  # Don't lose queued updates if we exit early
+
+    def run(self, coroutine):  # Runs a coroutine on our event loop and waits for its result
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        try:
+            self.run(self.client.close())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+
+    def __getattr__(self, name):  # Coroutines are run to completion and async generators become generators.  Everything else is the client's own attribute
+        if name == 'client':
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        if inspect.isasyncgenfunction(attribute):
+            return functools.partial(self.__iterate, attribute)
+        if inspect.iscoroutinefunction(attribute):
+            return lambda *args, **kwargs: self.run(attribute(*args, **kwargs))
+        return attribute
+
+    def __iterate(self, method, *args, **kwargs):
+        iterator = method(*args, **kwargs)
+        try:
+            while True:
+                try:
+                    item = self.run(iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            self.run(iterator.aclose())
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+import requests
+import threading
+import urllib.parse
+import email.utils
+
+def parseRetryAfter(retry_after):  # Seconds to wait from a Retry-After header, which is either a number of seconds or an HTTP date.  None if it's missing or unreadable
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        try:
+            return max(0.0, (email.utils.parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+class http_transport:  # Keep-alive sessions for outbound HTTP calls, one pool per host, so repeated calls to ThePornDB, Babepedia, and image hosts reuse connections (and TLS handshakes)
+    def __init__(self, proxies = {}, pool_size = 10, connect_timeout = 10, read_timeout = 30):
+        self.proxies = proxies
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def getSession(self, url):
+        parts = urllib.parse.urlsplit(url)
+        host = parts.scheme.lower()+"://"+parts.netloc.lower()
+        with self.lock:
+            session = self.sessions.get(host, None)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount(host, adapter)
+                session.proxies.update(self.proxies)
+                self.sessions[host] = session
+            return session
+
+    def get(self, url, **kwargs):  # Same as requests.get, with our timeouts unless others are given.  Close streamed responses (or use them in a with block) so their connection goes back to the pool
+        kwargs.setdefault('timeout', self.timeout)
+        return self.getSession(url).get(url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.getSession(url).head(url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
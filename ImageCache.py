@@ -0,0 +1,103 @@
+import hashlib
+import os
+import time
+import uuid
+
+from ResponseCache import normalizeURL, sqlite_cache
+
+class image_cache(sqlite_cache):  # On-disk cache of downloaded images.  Files are named by the SHA-256 of their content, so the same image from several URLs is stored once, and the index maps each source URL (and variant, e.g. "jpeg" for converted output) to a file.  The least recently used files are deleted once the cache grows past max_bytes
+    table = "images"
+    key_column = "digest"
+
+    def __init__(self, cache_dir, max_bytes = 500*1024*1024):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        sqlite_cache.__init__(self, os.path.join(cache_dir, "index.sqlite"), max_bytes)
+
+    def createTables(self):
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS images (
+            digest TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            accessed_at REAL NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS images_accessed_at ON images (accessed_at)")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS sources (
+            url TEXT NOT NULL,
+            variant TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            PRIMARY KEY (url, variant))""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS sources_digest ON sources (digest)")
+
+    def getPath(self, digest):
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def get(self, url, variant):  # Returns the cached bytes for url, or None
+        key = normalizeURL(url)
+        with self.lock:
+            if not self.isOpen():
+                return None
+            row = self.connection.execute("SELECT digest FROM sources WHERE url = ? AND variant = ?", (key, variant)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            digest = row[0]
+            self.touch(digest)
+        try:  # Read without the lock, so other threads aren't held up by the disk
+            with open(self.getPath(digest), 'rb') as f:
+                data = f.read()
+        except OSError:  # Deleted from under us (or just evicted); forget it
+            data = None
+        with self.lock:
+            if data is None:
+                if self.isOpen():
+                    self.forget([digest])
+                self.stats['misses'] += 1
+            else:
+                self.stats['hits'] += 1
+        return data
+
+    def put(self, url, variant, data):
+        for chunk in self.storing(url, variant, [data]):
+            pass
+
+    def storing(self, url, variant, chunks):  # Passes chunks through, writing them to the cache as they go.  They're only stored if all of them are consumed
+        temp_path = os.path.join(self.cache_dir, "."+uuid.uuid4().hex+".tmp")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    digest.update(chunk)
+                    size = size + len(chunk)
+                    yield chunk
+            self.__store(normalizeURL(url), variant, digest.hexdigest(), size, temp_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def __store(self, key, variant, digest, size, temp_path):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if not self.isOpen():
+                return
+            path = self.getPath(digest)
+            known = self.connection.execute("SELECT size FROM images WHERE digest = ?", (digest,)).fetchone()
+            if known is None or not os.path.exists(path):  # Otherwise we already have this image, maybe from another URL
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            now = time.time()
+            self.connection.execute("INSERT OR REPLACE INTO images (digest, size, accessed_at) VALUES (?, ?, ?)", (digest, size, now))
+            self.connection.execute("INSERT OR REPLACE INTO sources (url, variant, digest) VALUES (?, ?, ?)", (key, variant, digest))
+            self.stored(size - (known[0] if known else 0))
+
+    def forget(self, digests):  # Also drops the URLs that pointed to each image, and its file
+        with self.transaction():
+            for digest in digests:
+                self.connection.execute("DELETE FROM sources WHERE digest = ?", (digest,))
+        sqlite_cache.forget(self, digests)
+        for digest in digests:
+            try:
+                os.remove(self.getPath(digest))
+            except OSError:
+                pass
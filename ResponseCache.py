@@ -0,0 +1,148 @@
+import sqlite3
+import logging
+import threading
+import atexit
+import contextlib
+import time
+import urllib.parse
+
+def normalizeURL(url):  # Returns url with the host lowercased and query parameters sorted, so equivalent requests share a cache entry
+    parts = urllib.parse.urlsplit(url)
+    netloc = parts.netloc.lower()
+    if (parts.scheme == "https" and netloc.endswith(":443")) or (parts.scheme == "http" and netloc.endswith(":80")):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    return urllib.parse.urlunsplit((parts.scheme.lower(), netloc, parts.path or "/", urllib.parse.urlencode(query, quote_via=urllib.parse.quote), ""))
+
+class sqlite_cache:  # Shared by response_cache and image_cache: one SQLite connection used by every thread, the total size of what's cached, and least recently used eviction once that grows past max_bytes
+    table = ""  # Has a row per entry, with key_column, size and accessed_at columns.  Subclasses create it in createTables
+    key_column = ""
+
+    def __init__(self, database_file, max_bytes):
+        self.database_file = database_file
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()  # Guards the connection, size and stats
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self.connection = sqlite3.connect(database_file, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.createTables()
+        self.size = self.totalSize()
+        atexit.register(self.close)
+
+    def createTables(self):
+        raise NotImplementedError
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.connection.execute("BEGIN")
+        try:
+            yield self.connection
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    # The rest are called with the lock held
+    def isOpen(self):  # False once closed at exit
+        return self.connection is not None
+
+    def totalSize(self):
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM "+self.table).fetchone()[0]
+
+    def touch(self, key, now = None):  # Marks an entry as just used
+        self.connection.execute("UPDATE "+self.table+" SET accessed_at = ? WHERE "+self.key_column+" = ?", (now or time.time(), key))
+
+    def stored(self, added_bytes):  # Accounts for an entry a subclass just stored (less the size of any entry it replaced), and evicts if we're now too large
+        self.size = self.size + added_bytes
+        self.stats['stores'] += 1
+        if self.size > self.max_bytes:
+            self.evict(int(self.max_bytes*0.9))  # Leave some room, so we don't evict on every store
+
+    def evict(self, target_bytes):  # Forgets the least recently used entries until the cache is no larger than target_bytes
+        evicted = []
+        size = self.size
+        for key, entry_size in self.connection.execute("SELECT "+self.key_column+", size FROM "+self.table+" ORDER BY accessed_at"):
+            if size <= target_bytes:
+                break
+            evicted.append(key)
+            size = size - entry_size
+        self.forget(evicted)
+        self.stats['evictions'] += len(evicted)
+        logging.debug("Evicted "+str(len(evicted))+" entries from "+self.database_file)
+
+    def forget(self, keys):  # Deletes entries by key and takes them out of size.  Subclasses that keep more than a row per entry extend it
+        with self.transaction():
+            for key in keys:
+                row = self.connection.execute("SELECT size FROM "+self.table+" WHERE "+self.key_column+" = ?", (key,)).fetchone()
+                self.connection.execute("DELETE FROM "+self.table+" WHERE "+self.key_column+" = ?", (key,))
+                if row:
+                    self.size = self.size - row[0]
+
+    def getStats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def close(self):
+        with self.lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+class response_cache(sqlite_cache):  # On-disk cache of HTTP response bodies, keyed by normalized URL.  Entries expire after the max_age they were stored with, and the least recently used are evicted once the cache grows past max_bytes
+    table = "responses"
+    key_column = "url"
+
+    def __init__(self, cache_file, max_bytes = 100*1024*1024):
+        self.cache_file = cache_file
+        sqlite_cache.__init__(self, cache_file, max_bytes)
+
+    def createTables(self):
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            body TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL)""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.connection.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    def get(self, url):  # Returns the cached body for url, or None if it isn't cached or has expired
+        key = normalizeURL(url)
+        now = time.time()
+        with self.lock:
+            if not self.isOpen():
+                return None
+            row = self.connection.execute("SELECT body, expires_at FROM responses WHERE url = ?", (key,)).fetchone()
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            body, expires_at = row
+            if expires_at <= now:
+                self.forget([key])
+                self.stats['misses'] += 1
+                return None
+            self.touch(key, now)
+            self.stats['hits'] += 1
+            return body
+
+    def put(self, url, body, max_age):  # Caches body for url for max_age seconds
+        if max_age <= 0:
+            return
+        key = normalizeURL(url)
+        size = len(body.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self.lock:
+            if not self.isOpen():
+                return
+            row = self.connection.execute("SELECT size FROM responses WHERE url = ?", (key,)).fetchone()
+            self.connection.execute("INSERT OR REPLACE INTO responses (url, body, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)", (key, body, size, now+max_age, now))
+            self.stored(size - (row[0] if row else 0))
+
+    def evict(self, target_bytes):  # Expired entries go first
+        with self.transaction():
+            self.connection.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self.size = self.totalSize()
+        sqlite_cache.evict(self, target_bytes)
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timezone
 import requests
 import logging
 import sys
@@ -8,6 +8,17 @@ import math
 import re
 import argparse
 import json
+import os
+import threading
+import atexit
+import collections
+import contextlib
+import functools
+import itertools
+import random
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from HttpTransport import parseRetryAfter
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 #Utility Functions
@@ -49,11 +60,205 @@ def listToLower(input_list):
             output_list.append(item)
     return output_list
 
-#Stash GraphQL Class
-class stash_interface:
-    performers = []
-    studios = []
-    tags = []
+def splitAliases(performer):
+    if isinstance(performer.get('aliases', None), str): performer['aliases'] = [alias.strip() for alias in performer['aliases'].split(',')] #Convert comma delimited string to list
+    return performer
+
+def graphQLOperationName(query):  # The operation name (e.g. "sceneUpdate"), or for an anonymous query the first field it selects (e.g. "jobStatus")
+    match = re.match(r'\s*(?:query|mutation)\s+(\w+)', query) or re.search(r'\{\s*(\w+)', query)
+    return match.group(1) if match else "unknown"
+
+def directoryPath(path):  # path with a trailing separator, so matching it doesn't also match sibling directories whose names start the same way (e.g. "/dl/Show 2/" for "/dl/Show")
+    if path.endswith(("/", "\\")):
+        return path
+    return path + ("\\" if "\\" in path and "/" not in path else "/")
+
+def normalizeTagName(name):  # Tags are matched ignoring case, spaces, dashes and parentheses
+    return name.lower().replace('-', ' ').replace('(', '').replace(')', '').strip().replace(' ', '')
+
+#Scene fields requested by findScenes/iterScenes.  SCENE_FIELDS is everything createSceneUpdateData needs; SCENE_FIELDS_MINIMAL is enough to decide whether (and how) to scrape a scene
+SCENE_FIELDS = """
+                  id
+                  title
+                  oshash
+                  details
+                  url
+                  date
+                  rating
+                  path
+                  studio {
+                    id
+                    name
+                    }
+                  gallery
+                    {
+                        id
+                    }
+                  movies
+                    {
+                        movie 
+                        {
+                            id
+                        }
+                    scene_index
+                    }
+                  performers
+                    {
+                        name
+                        id
+                    }
+                  tags
+                    {
+                        name
+                        id
+                    }
+                """
+
+SCENE_FIELDS_MINIMAL = """
+                  id
+                  title
+                  oshash
+                  date
+                  path
+                  studio {
+                    id
+                    name
+                    }
+                  tags
+                    {
+                        id
+                    }
+                """
+
+#Cached Stash Entities.  Performers, studios and tags stay in memory for the whole run, so they're kept as compact slotted records with interned names rather than raw JSON dicts
+class stash_record:
+    __slots__ = ()
+
+    def __init__(self, data):
+        for field in self.__slots__:
+            value = data.get(field, None)
+            if field == 'id' and isinstance(value, str) and value.isdigit(): value = int(value)  # Stash IDs are numeric strings; ints are a fraction of the size
+            elif isinstance(value, str) and field != 'image_path': value = sys.intern(value)
+            setattr(self, field, value)
+
+    def toDict(self):  # A new dict in the shape Stash returns, so callers can change it without affecting the cache
+        record = {field: getattr(self, field) for field in self.__slots__}
+        record['id'] = str(self.id) if self.id is not None else None
+        return record
+
+class stash_performer(stash_record):
+    __slots__ = ('id', 'name', 'aliases', 'image_path')
+
+    def __init__(self, data):
+        stash_record.__init__(self, splitAliases(dict(data)))
+        if self.aliases is not None: self.aliases = tuple(sys.intern(alias) if isinstance(alias, str) else alias for alias in self.aliases)
+
+    def toDict(self):
+        performer = stash_record.toDict(self)
+        if self.aliases is not None: performer['aliases'] = list(self.aliases)
+        return performer
+
+class stash_studio(stash_record):
+    __slots__ = ('id', 'name', 'url', 'image_path')
+
+class stash_tag(stash_record):
+    __slots__ = ('id', 'name')
+
+#Paging decisions for iterScenes, shared by both clients, which only differ in how they request pages.
+#The caller may update scenes between pages so that they no longer match scene_filter (e.g., by adding an excluded tag).  When the count drops, later scenes have moved up to earlier pages,
+#so we step back by the number of pages removed (even if the page we got was empty) and skip scenes we already returned.  Prefetched pages are requested before the caller's updates land, so they are discarded and requested again when that happens
+class scene_pager:
+    def __init__(self, stash, page, per_page, max_scenes = None, adapt_per_page = False):
+        self.stash = stash  # For adaptPerPage
+        self.next_page = page
+        self.per_page = per_page
+        self.max_scenes = max_scenes
+        self.adapt_per_page = adapt_per_page  # Resize pages after the first one, from how long it took
+        self.returned_ids = set()
+        self.count = None  # From the latest page
+        self.last_count = None
+        self.finished = False
+
+    def takePage(self):  # The (page, per_page) to request next
+        page = self.next_page
+        self.next_page = self.next_page + 1
+        return page, self.per_page
+
+    def readPage(self, page, page_size, result):  # Returns the scenes in a findScenes result
+        stashScenes = result["data"]["findScenes"]["scenes"]
+        self.count = result["data"]["findScenes"]["count"]
+        total_pages = math.ceil(min(self.count, self.max_scenes or self.count) / page_size)
+        print("Getting Stash Scenes Page: "+str(page)+" of "+str(total_pages))
+        return stashScenes
+
+    def newScenes(self, stashScenes):  # The scenes we haven't returned yet, up to max_scenes in all
+        new_scenes = []
+        for scene in stashScenes:
+            if self.reachedMax():
+                break
+            if scene["id"] not in self.returned_ids:
+                self.returned_ids.add(scene["id"])
+                new_scenes.append(scene)
+        return new_scenes
+
+    def reachedMax(self):
+        return bool(self.max_scenes) and len(self.returned_ids) >= self.max_scenes
+
+    def pageDone(self, page, page_size, empty, elapsed):  # Picks the next page after one has been returned.  True if pages requested ahead are now wrong and must be discarded
+        discard = False
+        if self.last_count is not None and self.count < self.last_count:
+            discard = True
+            self.next_page = max(1, page - math.ceil((self.last_count - self.count) / page_size))
+        elif empty:
+            self.finished = True
+        elif self.adapt_per_page:
+            self.adapt_per_page = False
+            new_per_page = self.stash.adaptPerPage(page_size, elapsed, self.max_scenes)
+            if new_per_page != self.per_page:
+                discard = True
+                self.next_page = (page * page_size) // new_per_page + 1  # The new first page may overlap scenes we've returned; those are skipped
+                self.per_page = new_per_page
+        self.last_count = self.count
+        return discard
+
+    def isFinished(self, pending):  # pending is the number of pages requested ahead
+        return self.finished or (pending == 0 and (self.next_page - 1) * self.per_page >= self.count)
+
+    def canPrefetch(self):
+        return (self.next_page - 1) * self.per_page < min(self.count, self.max_scenes or self.count)
+
+#Shared by stash_interface and the asyncio client in AsyncStashInterface: settings, the performer/studio/tag cache, snapshots, and the parts of each call that don't depend on how we talk to Stash
+class stash_interface_base:
+    performers = None  # Downloaded the first time they're needed; see loadCollection
+    studios = None
+    tags = None
+    performer_names = {}  # Lookup indexes; each maps a normalized name to a position in performers/studios/tags
+    performer_aliases = {}
+    studio_names = {}
+    tag_names = {}
+    scene_update_batch_size = 0  # Set by enableWriteBehind
+    scene_update_max_delay = 0
+    scene_update_queue = []
+    scene_update_timer = None  # Sends the queue max_delay seconds after its first update, even if no more updates come
+    snapshot_file = ""  # See enableSnapshot
+    snapshot = {}
+    snapshot_dirty = False
+    snapshot_max_age = 86400  # Seconds after a collection was downloaded from Stash that its snapshot may be reused, even if its fingerprint still matches
+    record_classes = {'performers': stash_performer, 'studios': stash_studio, 'tags': stash_tag}
+    collection_queries = {'performers': 'findPerformers', 'studios': 'findStudios', 'tags': 'findTags'}
+    idle_ttl = 0  # Seconds an Idle job status is trusted before mutations check again; see setIdleTTL
+    idle_checked_at = 0
+    idle_checks_enabled = True
+    idle_poll_min = 2  # Busy polling backs off from idle_poll_min to idle_poll_max seconds
+    idle_poll_max = 30
+    retry_max_seconds = 120  # Total time a call to Stash may spend waiting on retries
+    retry_base_delay = 1
+    retry_max_delay = 30
+    idempotent_mutations = ('sceneUpdate', 'performerUpdate', 'studioUpdate', 'tagUpdate')
+    metrics_file = ""  # See enableMetrics
+    slow_query_seconds = 5  # Calls slower than this are kept in the slow query log
+    max_slow_queries = 100
+    latency_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # Upper bounds, in seconds, of the latency histogram
     server = ""
     username = ""
     password = ""
@@ -61,7 +266,13 @@ class stash_interface:
     http_auth_type = ""
     auth_token = ""
     proxies = {}
+    session = None
     min_buildtime = datetime(2020, 6, 22) 
+    image_url_buildtime = datetime(2020, 10, 1)  # Builds from here on download image URLs given for cover_image/image themselves, rather than only accepting base64
+    version_buildtime = None
+    scene_page_seconds = 2.0  # iterScenes sizes pages so each takes about this long to fetch, within min/max_scene_page_size
+    min_scene_page_size = 25
+    max_scene_page_size = 1000
     
     headers = {
         "Accept-Encoding": "gzip, deflate, br",
@@ -76,19 +287,504 @@ class stash_interface:
         self.username = user
         self.password = pword
         self.ignore_ssl_warnings = ignore_ssl
-        if ignore_ssl: requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
         self.debug_mode = debug
+        self.stats_lock = threading.Lock()
+        self.scene_update_lock = threading.RLock()  # Guards the write-behind queue, which the max_delay timer flushes from its own thread
+        self.retry_stats = {'retried_calls': 0, 'retries': 0, 'retry_seconds': 0.0, 'failed_calls': 0}
+        self.call_metrics = {}  # Operation name -> totals and latency histogram; see recordCall
+        self.input_fields = {}  # Input type name -> field names; see getInputFields
+        self.fingerprints = {}  # Collection -> {'fingerprint': ..., 'loaded_at': ...} for the loaded performers, studios and tags; see buildFingerprintQuery
+        self.slow_queries = collections.deque(maxlen=self.max_slow_queries)
+
+    def setProxies(self, proxies):  # Proxies are only used for image downloads, not for GraphQL calls
+        self.proxies = proxies
+
+    def setIdleTTL(self, idle_ttl):
+        self.idle_ttl = idle_ttl
+
+    @contextlib.contextmanager
+    def skipIdleChecks(self):  # Mutations inside this block are sent without checking the job status first
+        previous = self.idle_checks_enabled
+        self.idle_checks_enabled = False
+        try:
+            yield self
+        finally:
+            self.idle_checks_enabled = previous
+
+    #Retry Functions.  Queries are always retried.  Mutations are retried if Stash rejected them outright (database is locked), or if they are idempotent updates
+    def isRetriable(self, query):
+        if "mutation" not in query:
+            return True
+        mutations = re.findall(r'(\w+)\s*\(\s*input\s*:', query)
+        return len(mutations) > 0 and all(mutation in self.idempotent_mutations for mutation in mutations)
+
+    def handleResponse(self, query, variables, status, result, attempt, retry_after = None, reauth = False):  # Decides what to do with a response from Stash.  Returns ('done', result), ('reauth', None) if we should log in again and resend, or ('retry', delay).  Raises if the call failed
+        if status == 200:
+            errors = result.get("errors", None) or []
+            if any("database is locked" in str(error.get("message", "")) for error in errors):
+                return 'retry', self.retryDelay(attempt)  # Stash rejected the whole request, so it's safe to send again, even for a mutation
+            for error in errors:
+                logging.error("GraphQL error:  {}".format(error), exc_info=self.debug_mode)
+            return 'done', result if result.get("data", None) else None
+        if reauth and status == 401 and self.http_auth_type == "jwt":
+            return 'reauth', None
+        if (status == 429 or status >= 500) and self.isRetriable(query):
+            return 'retry', self.retryDelay(attempt, retry_after)
+        logging.error("GraphQL query failed to run by returning code of {}. Query: {}.  Variables: {}".format(status, query, variables), exc_info=self.debug_mode)
+        raise Exception("GraphQL error")
+
+    def connectionRetryDelay(self, query, attempt):  # Delay before resending a call that couldn't reach Stash, or None if it isn't safe to resend
+        return self.retryDelay(attempt) if self.isRetriable(query) else None
+
+    def startRetry(self, query, variables, started, attempt, delay):  # Records a retry we're about to wait delay seconds for.  Raises if that would take the call past retry_max_seconds
+        if time.time() - started + delay > self.retry_max_seconds:
+            self.countRetry(gave_up = True)
+            logging.error("Giving up on GraphQL query after {} retries. Query: {}.  Variables: {}".format(attempt, query, variables), exc_info=self.debug_mode)
+            raise Exception("GraphQL error")
+        logging.warning("Stash is unavailable or busy.  Retrying in {:.1f} seconds.".format(delay))
+        self.countRetry(delay, first = attempt == 0)
+
+    def retryDelay(self, attempt, retry_after = None):  # Exponential backoff with jitter, unless the server told us how long to wait
+        delay = parseRetryAfter(retry_after)
+        if delay is not None:
+            return delay
+        delay = min(self.retry_base_delay * 2 ** attempt, self.retry_max_delay)
+        return delay + random.uniform(0, delay / 2)
+
+    def countRetry(self, seconds = 0, first = False, gave_up = False):
+        with self.stats_lock:
+            self.retry_stats['retries'] = self.retry_stats['retries'] + (0 if gave_up else 1)
+            self.retry_stats['retried_calls'] = self.retry_stats['retried_calls'] + (1 if first else 0)
+            self.retry_stats['retry_seconds'] = self.retry_stats['retry_seconds'] + seconds
+            self.retry_stats['failed_calls'] = self.retry_stats['failed_calls'] + (1 if gave_up else 0)
+
+    def setRetryBudget(self, retry_max_seconds):
+        self.retry_max_seconds = retry_max_seconds
+
+    def getRetryStats(self):  # How many calls to Stash needed retries, and how much time we spent waiting on them
+        with self.stats_lock:
+            return dict(self.retry_stats)
+
+    #Metrics Functions.  Every callGraphQL is recorded by operation name, so we can see where a run spends its time
+    def recordCall(self, operation, seconds, call, failed = False):
+        with self.stats_lock:
+            metrics = self.call_metrics.get(operation, None)
+            if metrics is None:
+                metrics = {'calls': 0, 'failed_calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'request_bytes': 0, 'response_bytes': 0, 'retries': 0, 'buckets': [0] * (len(self.latency_buckets) + 1)}
+                self.call_metrics[operation] = metrics
+            metrics['calls'] = metrics['calls'] + 1
+            metrics['failed_calls'] = metrics['failed_calls'] + (1 if failed else 0)
+            metrics['seconds'] = metrics['seconds'] + seconds
+            metrics['max_seconds'] = max(metrics['max_seconds'], seconds)
+            metrics['request_bytes'] = metrics['request_bytes'] + call['request_bytes']
+            metrics['response_bytes'] = metrics['response_bytes'] + call['response_bytes']
+            metrics['retries'] = metrics['retries'] + call['retries']
+            bucket = 0
+            while bucket < len(self.latency_buckets) and seconds > self.latency_buckets[bucket]:
+                bucket = bucket + 1
+            metrics['buckets'][bucket] = metrics['buckets'][bucket] + 1
+            if seconds >= self.slow_query_seconds:
+                self.slow_queries.append({'operation': operation, 'seconds': round(seconds, 3), 'request_bytes': call['request_bytes'], 'response_bytes': call['response_bytes'], 'retries': call['retries'], 'failed': failed, 'at': datetime.now(timezone.utc).isoformat()})
+
+    def getMetrics(self):  # Totals per operation, with cumulative latency histogram counts keyed by bucket upper bound, and the slow query log
+        with self.stats_lock:
+            operations = {}
+            for operation, metrics in self.call_metrics.items():
+                operations[operation] = {key: value for key, value in metrics.items() if key != 'buckets'}
+                operations[operation]['latency_buckets'] = dict(zip([str(bound) for bound in self.latency_buckets] + ['+Inf'], itertools.accumulate(metrics['buckets'])))
+            return {'operations': operations, 'slow_queries': list(self.slow_queries)}
+
+    def enableMetrics(self, metrics_file, slow_query_seconds = 5):  # Writes metrics to metrics_file at exit and on SIGUSR1.  Files ending in .prom are written in Prometheus text format, anything else as JSON
+        self.metrics_file = metrics_file
+        self.slow_query_seconds = slow_query_seconds
+        atexit.register(self.writeMetrics)
+        if hasattr(signal, 'SIGUSR1'):
+            try:
+                signal.signal(signal.SIGUSR1, lambda signum, frame: threading.Thread(target=self.writeMetrics, daemon=True).start())  # The handler runs on the main thread, which may be holding stats_lock in recordCall, so the metrics are written from another thread once it's released
+            except ValueError:  # Signal handlers can only be set from the main thread
+                logging.debug("Could not set a SIGUSR1 handler for writing metrics")
+
+    def writeMetrics(self, metrics_file = None):
+        metrics_file = metrics_file or self.metrics_file
+        if not metrics_file:
+            return
+        metrics = self.getMetrics()
+        try:
+            temp_file = metrics_file+".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                if metrics_file.endswith('.prom'):
+                    f.write(self.__formatPrometheus(metrics))
+                else:
+                    json.dump(metrics, f, indent=2)
+            os.replace(temp_file, metrics_file)
+        except Exception:
+            logging.warning("Could not write Stash metrics to "+metrics_file, exc_info=self.debug_mode)
+
+    def __formatPrometheus(self, metrics):  # Operation names are GraphQL names, so they never need escaping as label values
+        operations = sorted(metrics['operations'].items())
+        lines = []
+        lines.append("# HELP stash_graphql_duration_seconds Time spent in callGraphQL, including retries")
+        lines.append("# TYPE stash_graphql_duration_seconds histogram")
+        for operation, values in operations:
+            for bound, count in values['latency_buckets'].items():
+                lines.append('stash_graphql_duration_seconds_bucket{operation="'+operation+'",le="'+bound+'"} '+str(count))
+            lines.append('stash_graphql_duration_seconds_sum{operation="'+operation+'"} '+repr(values['seconds']))
+            lines.append('stash_graphql_duration_seconds_count{operation="'+operation+'"} '+str(values['calls']))
+        for name, key, description in (('stash_graphql_request_bytes_total', 'request_bytes', 'Bytes sent to Stash'),
+                                       ('stash_graphql_response_bytes_total', 'response_bytes', 'Bytes received from Stash'),
+                                       ('stash_graphql_retries_total', 'retries', 'Retries after errors or a busy Stash'),
+                                       ('stash_graphql_failed_calls_total', 'failed_calls', 'Calls that raised an error')):
+            lines.append("# HELP "+name+" "+description)
+            lines.append("# TYPE "+name+" counter")
+            for operation, values in operations:
+                lines.append(name+'{operation="'+operation+'"} '+str(values[key]))
+        return "\n".join(lines)+"\n"
+
+    def checkBuildTime(self, version):  # Returns False if the version returned by Stash is older than this script supports
+        self.version_buildtime = datetime.strptime(version["build_time"], '%Y-%m-%d %H:%M:%S')
+        if self.version_buildtime < stash_interface_base.min_buildtime:
+            logging.error("Your Stash version appears too low to use this script.  Please upgrade to the latest \"development\" build and try again.", exc_info=self.debug_mode)
+            return False
+        return True
+
+    def scopeJobInput(self, variables, field, values, supported_fields):  # Returns a copy of a generate or auto tag input limited to values (scene IDs or paths), or None if there's nothing to run it on
+        if field not in supported_fields:
+            logging.warning("This version of Stash can't limit the task to specific scenes (no "+field+" input).  Running it on the whole library.")
+            return variables
+        if not values:
+            return None
+        return {'input': dict(variables['input'], **{field: list(values)})}
+
+    def supportsImageURLs(self):
+        return self.version_buildtime is not None and self.version_buildtime >= self.image_url_buildtime
+
+    #Index Functions.  The first entry in list order wins, which matches what a linear scan would return
+    def setCollection(self, collection, entries, fingerprint = None, loaded_at = None):  # Replaces 'performers', 'studios' or 'tags' with records built from entries returned by Stash (or the snapshot), and indexes them.  fingerprint is Stash's fingerprint for the collection from just before entries were fetched
+        self.fingerprints[collection] = {'fingerprint': fingerprint, 'loaded_at': loaded_at or time.time()}
+        if collection == 'performers':
+            self.performers = [stash_performer(performer) for performer in entries]
+            self.indexPerformers()
+        elif collection == 'studios':
+            self.studios = [stash_studio(studio) for studio in entries]
+            self.indexStudios()
+        elif collection == 'tags':
+            self.tags = [stash_tag(tag) for tag in entries]
+            self.indexTags()
+
+    def indexPerformers(self):
+        self.performer_names = {}
+        self.performer_aliases = {}
+        for position, performer in enumerate(self.performers):
+            self.__indexPerformer(position, performer)
+
+    def __indexPerformer(self, position, performer):
+        self.performer_names.setdefault(performer.name.lower(), position)
+        if performer.aliases is not None:
+            for alias in listToLower(performer.aliases):
+                self.performer_aliases.setdefault(alias, position)
+
+    def indexStudios(self):
+        self.studio_names = {}
+        for position, studio in enumerate(self.studios):
+            self.studio_names.setdefault(studio.name.lower().strip(), position)
+
+    def indexTags(self):
+        self.tag_names = {}
+        for position, tag in enumerate(self.tags):
+            self.tag_names.setdefault(normalizeTagName(tag.name), position)
+
+    #Cache Functions.  Newly created entities are added from the mutation response instead of re-downloading the full lists.  Lists that haven't been loaded yet will include them when they are
+    def cachePerformer(self, performer):
+        if self.performers is None: return
+        performer = stash_performer(performer)
+        self.performers.append(performer)
+        self.__indexPerformer(len(self.performers)-1, performer)
+        self.__updateFingerprint('performers', performer, True)
+
+    def cacheStudio(self, studio):
+        if self.studios is None: return
+        studio = stash_studio(studio)
+        self.studios.append(studio)
+        self.studio_names.setdefault(studio.name.lower().strip(), len(self.studios)-1)
+        self.__updateFingerprint('studios', studio, True)
+
+    def cacheTag(self, tag):
+        if self.tags is None: return
+        tag = stash_tag(tag)
+        self.tags.append(tag)
+        self.tag_names.setdefault(normalizeTagName(tag.name), len(self.tags)-1)
+        self.__updateFingerprint('tags', tag, True)
+
+    def recachePerformer(self, performer):  # Replaces a cached performer after an update, e.g. to pick up new aliases
+        if self.performers is None: return
+        for position, cached_performer in enumerate(self.performers):
+            if str(cached_performer.id) == performer['id']:
+                self.performers[position] = stash_performer(performer)
+                self.indexPerformers()
+                self.__updateFingerprint('performers', self.performers[position], False)
+                return
+
+    def __updateFingerprint(self, collection, record, created):  # Applies a change we made in Stash to the collection's fingerprint, so our own changes don't make the snapshot look stale on the next run
+        self.snapshot_dirty = True
+        entry = self.fingerprints.get(collection, None)
+        if not entry or not entry['fingerprint']:
+            return
+        fingerprint = dict(entry['fingerprint'], latest=record.toDict())
+        if created:
+            fingerprint['count'] = fingerprint['count'] + 1
+            fingerprint['newest_id'] = str(record.id)
+        entry['fingerprint'] = fingerprint
+
+    #Fingerprint Functions.  A fingerprint is a collection's count, the ID of its newest entry, and its most recently updated entry (with the fields we cache).
+    #Deleting, adding, renaming or otherwise editing an entry changes at least one of them, so a matching fingerprint means our copy of the collection is current
+    def buildFingerprintQuery(self, collections):  # One query for the fingerprints of several collections; see parseFingerprints
+        selections = []
+        for collection in collections:
+            find_query = self.collection_queries[collection]
+            fields = " ".join(self.record_classes[collection].__slots__)
+            selections.append(collection+"_latest: "+find_query+"(filter: {per_page: 1, sort: \"updated_at\", direction: DESC}){ count "+collection+"{ "+fields+" } }")
+            selections.append(collection+"_newest: "+find_query+"(filter: {per_page: 1, sort: \"created_at\", direction: DESC}){ "+collection+"{ id } }")
+        return "{ "+" ".join(selections)+" }"
+
+    def parseFingerprints(self, collections, data):  # Collection -> fingerprint, from the result of buildFingerprintQuery
+        fingerprints = {}
+        for collection in collections:
+            latest = data[collection+"_latest"]
+            newest = data[collection+"_newest"][collection]
+            fingerprints[collection] = {
+                'count': latest['count'],
+                'newest_id': str(newest[0]['id']) if newest else None,
+                'latest': self.record_classes[collection](latest[collection][0]).toDict() if latest[collection] else None}
+        return fingerprints
+
+    def isCurrent(self, collection, fingerprint):  # True if the loaded collection still matches fingerprint, which was just fetched from Stash
+        entry = self.fingerprints.get(collection, None)
+        return entry is not None and entry['fingerprint'] is not None and entry['fingerprint'] == fingerprint
+
+    #Snapshot Functions.  Performers, studios and tags are saved to disk with their fingerprints, and reused on the next run if Stash's fingerprints still match and they aren't older than max_age seconds
+    def enableSnapshot(self, snapshot_file, max_age = 86400):
+        self.snapshot_file = snapshot_file
+        self.snapshot_max_age = max_age
+        self.snapshot = {}
+        try:
+            with open(snapshot_file, encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('server', None) == self.server:
+                self.snapshot = snapshot
+        except FileNotFoundError:
+            pass
+        except Exception:
+            logging.warning("Could not read Stash snapshot "+snapshot_file+"; it will be rebuilt", exc_info=self.debug_mode)
+        atexit.register(self.saveSnapshot, True)
+
+    def hasSnapshot(self, collection):
+        return bool(self.snapshot_file) and self.snapshot.get(collection, None) is not None
+
+    def restoreSnapshot(self, collection, fingerprint):  # Loads a collection from the snapshot if it was saved with fingerprint, which Stash has now, and hasn't expired
+        if not self.hasSnapshot(collection):
+            return False
+        saved = self.snapshot.get('fingerprints', {}).get(collection, None)
+        if not saved or saved.get('fingerprint', None) is None or saved['fingerprint'] != fingerprint:
+            logging.debug("The snapshot of "+collection+" is out of date")
+            return False
+        if time.time() - saved.get('loaded_at', 0) > self.snapshot_max_age:
+            logging.debug("The snapshot of "+collection+" has expired")
+            return False
+        entries = self.snapshot.pop(collection)  # Saved again from the loaded records
+        self.setCollection(collection, entries, fingerprint, saved['loaded_at'])
+        logging.debug("Loaded "+str(len(entries))+" "+collection+" from snapshot")
+        return True
+
+    def saveSnapshot(self, only_if_dirty = False):
+        if not self.snapshot_file or (only_if_dirty and not self.snapshot_dirty):
+            return
+        snapshot = dict(self.snapshot)  # Keeps entries for collections we haven't loaded
+        snapshot['server'] = self.server
+        snapshot['fingerprints'] = dict(self.snapshot.get('fingerprints', {}))
+        for collection in ('performers', 'studios', 'tags'):
+            if getattr(self, collection) is not None:
+                snapshot[collection] = [record.toDict() for record in getattr(self, collection)]
+                snapshot['fingerprints'][collection] = self.fingerprints.get(collection, None)
+        try:
+            temp_file = self.snapshot_file+".tmp"
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(temp_file, self.snapshot_file)
+            self.snapshot_dirty = False
+        except Exception:
+            logging.warning("Could not save Stash snapshot "+self.snapshot_file, exc_info=self.debug_mode)
+
+    #Lookup Functions.  These only search what's cached; getPerformerByName and friends make sure the collection is loaded first
+    def __getPerformerByName(self, name, check_aliases = False):  # A private function that allows disabling of checking for aliases
+        positions = [self.performer_names.get(name, None)] # Check input name against performer name
+        if check_aliases:  # Check input name against performer aliases
+            positions.append(self.performer_aliases.get(name, None))
+        positions = [position for position in positions if position is not None]
+        if positions:
+            return self.performers[min(positions)].toDict()  # Whichever performer comes first in the list, as a name or an alias match
+        return None
+    
+    def findCachedPerformer(self, name, aliases = []):
+        name = name.lower()
+        input_aliases_lower = listToLower(aliases)
+        
+        result = self.__getPerformerByName(name, True)
+        if result:  # This matches input name with existing name or alias 
+            return result
+        
+        for input_alias in input_aliases_lower: # For each alias, recurse w/ name = alias, but disable alias to alias mapping
+            result = self.__getPerformerByName(input_alias, False)
+            if result:
+                return result
+        
+        return None            
+
+    def findCachedStudio(self, name):
+        position = self.studio_names.get(name.lower().strip(), None)
+        if position is not None:
+            return self.studios[position].toDict()
+        return None
+    
+    def findCachedTag(self, name):
+        logging.debug("Getting tag id for tag \'"+name+"\'.")
+        position = self.tag_names.get(normalizeTagName(name), None)
+        if position is not None:
+            tag = self.tags[position].toDict()
+            logging.debug("Found the tag.  ID is "+tag['id'])
+            return tag
+        return None
+
+    #Scene Query Functions
+    def buildFindScenes(self, kwargs):  # Returns the findScenes query and variables for the arguments accepted by findScenes: filter, scene_filter, scene_ids, path, max_scenes and fields
+        variables = {}
+        max_scenes = kwargs.get("max_scenes", None)
+        fields = kwargs.get("fields", SCENE_FIELDS)  # Selection set for each scene, e.g. SCENE_FIELDS_MINIMAL.  Use hydrateScenes to get the rest later
+        accepted_variables = {'filter':'FindFilterType!','scene_filter': 'SceneFilterType!','scene_ids':'[Int!]'}
+
+        #Add accepted variables to our passsed variables
+        for accepted_variable in accepted_variables:
+            if accepted_variable in kwargs:
+                variables[accepted_variable] = kwargs[accepted_variable]
+
+        #Only scenes under the directory 'path' (e.g., a directory that was just scanned).  Needs a Stash that supports the path filter; see getSceneFilterFields
+        if kwargs.get("path", None):
+            variables['scene_filter'] = dict(variables.get('scene_filter', {}), path={'modifier': 'INCLUDES', 'value': directoryPath(kwargs["path"])})
+
+        #Set page and per_page, if not set
+        variables['filter'] = dict(variables.get('filter', {}))  #Copy, since we change the page as we go
+        variables['filter'].setdefault('page', 1)
+        if max_scenes:
+            variables['filter'].setdefault('per_page', min(100, max_scenes))
+        else:
+            variables['filter'].setdefault('per_page', 100)
+            
+        #Build our query string (e.g., "findScenes(filter:FindFilterType!){" )
+        query_string = "query("+", ".join(":".join(("$"+str(k),accepted_variables[k])) for k,v in variables.items())+'){'
+
+        #Build our findScenes string
+        findScenes_string = "findScenes("+", ".join(":".join((str(k),"$"+str(k))) for k,v in variables.items())+'){'
+
+        query = query_string+findScenes_string+"""
+                count
+                scenes{"""+fields+"""}
+              }
+            }
+            """
+        return query, variables
+
+    def buildScenePager(self, kwargs, variables):  # A scene_pager for the arguments to iterScenes and the variables from buildFindScenes
+        adapt_per_page = 'per_page' not in kwargs.get('filter', {})  #Unless the caller picked a page size, adjust it after the first page
+        return scene_pager(self, variables['filter']['page'], variables['filter']['per_page'], kwargs.get("max_scenes", None), adapt_per_page)
+
+    def needsHydrating(self, scene):  # True for a scene listed with fewer fields than SCENE_FIELDS, e.g. SCENE_FIELDS_MINIMAL
+        return not all(field in scene for field in ('details', 'gallery', 'movies', 'performers'))
+
+    def buildHydrateScenes(self, scene_ids):  # Returns the findScenes query and variables that fetch SCENE_FIELDS for all of scene_ids in one page
+        return self.buildFindScenes({'scene_ids': [int(scene_id) for scene_id in scene_ids], 'filter': {'per_page': len(scene_ids)}})
+
+    def hydratedScenes(self, scenes, result):  # scenes, with each replaced by its full data from a buildHydrateScenes result.  Scenes Stash didn't return (e.g. deleted since they were listed) are left as they were
+        full_scenes = {scene['id']: scene for scene in result["data"]["findScenes"]["scenes"]}
+        return [full_scenes.get(scene['id'], scene) for scene in scenes]
+
+    def adaptPerPage(self, page_size, elapsed, max_scenes = None):  # A page size that should take about scene_page_seconds to fetch, given how long the last page took
+        new_per_page = int(page_size * self.scene_page_seconds / max(elapsed, 0.001))
+        new_per_page = max(self.min_scene_page_size, min(self.max_scene_page_size, new_per_page))
+        if max_scenes: new_per_page = min(new_per_page, max_scenes)
+        return new_per_page
+
+    def buildSceneUpdates(self, queue):  # Returns one mutation with an aliased sceneUpdate per queued scene, and its variables
+        variable_definitions = []
+        updates = []
+        variables = {}
+        for index, scene_data in enumerate(queue):
+            variable_definitions.append("$input{0}:SceneUpdateInput!".format(index))
+            updates.append("      update{0}: sceneUpdate(input: $input{0}){{ id }}".format(index))
+            variables["input"+str(index)] = scene_data
+        query = "mutation sceneUpdates("+", ".join(variable_definitions)+") {\n"+"\n".join(updates)+"\n    }"
+        return query, variables
+
+    def logSceneUpdateErrors(self, queue, result):  # Logs each scene in a batch that Stash didn't update
+        errors = {}
+        for error in result.get("errors", None) or []:
+            if error.get("path", None): errors[error["path"][0]] = error.get("message", error)
+        for index, scene_data in enumerate(queue):
+            alias = "update"+str(index)
+            if result["data"].get(alias, None) is None:
+                logging.error("Error updating scene "+str(scene_data.get("id", None))+": "+str(errors.get(alias, "no result returned")))
+
+    def createSceneUpdateData(self, scene_data):  #Scene data returned from stash has a different format than what is accepted by the UpdateScene graphQL query.  This converts one format to another
+        scene_update_data = {}
+        if keyIsSet(scene_data, "id"): scene_update_data["id"] = scene_data["id"]
+        if keyIsSet(scene_data, "title"): scene_update_data["title"] = scene_data["title"]
+        if keyIsSet(scene_data, "details"): scene_update_data["details"] = scene_data["details"]
+        if keyIsSet(scene_data, "url"): scene_update_data["url"] = scene_data["url"]
+        if keyIsSet(scene_data, "date"): scene_update_data["date"] = scene_data["date"]
+        if keyIsSet(scene_data, "rating"): scene_update_data["rating"] = scene_data["rating"]
+        if keyIsSet(scene_data, "studio"): scene_update_data["studio_id"] = scene_data["studio"]["id"]
+        if keyIsSet(scene_data, "gallery"): scene_update_data["gallery_id"] = scene_data["gallery"]["id"]
+        if keyIsSet(scene_data, "movies"):
+            scene_update_data["movies"] = []
+            for entry in scene_data["movies"]:
+                update_date_movie = {}
+                update_date_movie["movie_id"]=entry["movie"]["id"]
+                update_date_movie["scene_index"]=entry["scene_index"]
+                scene_update_data["movies"].append(update_date_movie)
+        else:
+            scene_update_data["movies"] = []
+        
+        if keyIsSet(scene_data, "performers"):
+            scene_update_data["performer_ids"] = []
+            for performer in scene_data["performers"]:
+                scene_update_data["performer_ids"].append(performer["id"])
+        else:
+            scene_update_data["performer_ids"] = []
+        if keyIsSet(scene_data, "tags"):
+            scene_update_data["tag_ids"] = []
+            for tag in scene_data["tags"]:
+                scene_update_data["tag_ids"].append(tag["id"])
+        else:
+            scene_update_data["tag_ids"] = []
+        return scene_update_data
+
+#Stash GraphQL Class
+class stash_interface(stash_interface_base):
+    def __init__(self, server_url, user = "", pword = "", ignore_ssl = "", debug = False, pool_size = 10):
+        stash_interface_base.__init__(self, server_url, user, pword, ignore_ssl, debug)
+        if ignore_ssl: requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+        self.createSession(pool_size)
         self.setAuth()
         self.checkVersion()
-        self.populatePerformers()
-        self.populateTags()
-        self.populateStudios()
 
-    def setProxies(self, proxies):
-        self.proxies = proxies
+    def createSession(self, pool_size = 10):  # One pooled keep-alive session is shared by every call to Stash, so connections (and TLS handshakes) are reused
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.verify = not self.ignore_ssl_warnings
+
 
     def setAuth(self):
-        r = requests.get(self.server+"/playground", verify= not self.ignore_ssl_warnings)
+        r = self.session.get(self.server+"/playground")
         if len(r.history)>0 and r.history[-1].status_code == 302:
             self.http_auth_type="jwt"
             self.jwtAuth()
@@ -96,64 +792,91 @@ class stash_interface:
             self.http_auth_type="none"
         else:
             self.http_auth_type="basic"
+            self.session.auth = (self.username, self.password)
         return
 
     def jwtAuth(self):
-        response = requests.post(self.server+"/login", data = {'username':self.username, 'password':self.password}, verify= not self.ignore_ssl_warnings)
+        response = self.session.post(self.server+"/login", data = {'username':self.username, 'password':self.password})
         self.auth_token=response.cookies.get('session',None)
         if not self.auth_token:
             logging.error("Error authenticating with Stash.  Double check your IP, Port, Username, and Password", exc_info=self.debug_mode)
             sys.exit()
+        self.session.cookies.set('session', self.auth_token)
     
     #GraphQL Functions    
     def callGraphQL(self, query, variables = None):
-        if "mutation" in query: self.waitForIdle() #Check that the DB is not locked
-        return self.__callGraphQL(query, variables)
+        if "mutation" in query and self.idle_checks_enabled: self.waitForIdle(self.idle_ttl) #Check that the DB is not locked
+        call = {'request_bytes': 0, 'response_bytes': 0, 'retries': 0}  # Filled in by __callGraphQL for recordCall
+        started = time.time()
+        failed = True
+        try:
+            result = self.__callGraphQL(query, variables, call)
+            failed = False
+        finally:
+            self.recordCall(graphQLOperationName(query), time.time() - started, call, failed)
+        if "mutation" in query and "metadata" in query: self.idle_checked_at = 0  #We just started a job, so the cached Idle status is stale
+        return result
 
-    def __callGraphQL(self, query, variables, retry = True):
+    def __callGraphQL(self, query, variables, call, retry = True):
         graphql_server = self.server+"/graphql"
         json = {}
         json['query'] = query
         if variables:
             json['variables'] = variables
         
-        try:
-            if self.http_auth_type == "basic":
-                response = requests.post(graphql_server, json=json, headers=self.headers, auth=(self.username, self.password), verify= not self.ignore_ssl_warnings)
-            elif self.http_auth_type == "jwt":
-                response = requests.post(graphql_server, json=json, headers=self.headers, cookies={'session':self.auth_token}, verify= not self.ignore_ssl_warnings)
-            else:
-                response = requests.post(graphql_server, json=json, headers=self.headers, verify= not self.ignore_ssl_warnings)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("error", None):
-                    for error in result["error"]["errors"]:
-                        logging.error("GraphQL error:  {}".format(error), exc_info=self.debug_mode)
-                if result.get("data", None):
-                    return result
-            elif retry and response.status_code == 401 and self.http_auth_type == "jwt":
-                self.jwtAuth()
-                return self.__callGraphQL(query, variables, False)
-            else:
-                logging.error("GraphQL query failed to run by returning code of {}. Query: {}.  Variables: {}".format(response.status_code, query, variables), exc_info=self.debug_mode)
-                raise Exception("GraphQL error")
-        except requests.exceptions.SSLError:
-            proceed = input("Caught certificate error trying to talk to Stash. Add ignore_ssl_warnings=True to your configuration.py to ignore permanently. Ignore for now? (yes/no):")
-            if proceed == 'y' or proceed == 'Y' or proceed =='Yes' or proceed =='yes':
-                self.ignore_ssl_warnings =True
-                requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
-                return self.callGraphQL(query, variables)
-            else:
-                print("Exiting.")
-                sys.exit()
+        started = time.time()
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(graphql_server, json=json, headers=self.headers)
+                call['request_bytes'] = call['request_bytes'] + len(response.request.body or b'')
+                call['response_bytes'] = call['response_bytes'] + len(response.content)
+                action, value = self.handleResponse(query, variables, response.status_code, response.json() if response.status_code == 200 else None, attempt, response.headers.get("Retry-After", None), retry)
+                if action == 'done':
+                    return value
+                if action == 'reauth':
+                    self.jwtAuth()
+                    retry = False
+                    continue
+                retry_after = value
+            except requests.exceptions.SSLError:
+                proceed = input("Caught certificate error trying to talk to Stash. Add ignore_ssl_warnings=True to your configuration.py to ignore permanently. Ignore for now? (yes/no):")
+                if proceed == 'y' or proceed == 'Y' or proceed =='Yes' or proceed =='yes':
+                    self.ignore_ssl_warnings =True
+                    self.session.verify = False
+                    requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
+                    return self.callGraphQL(query, variables)
+                else:
+                    print("Exiting.")
+                    sys.exit()
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                retry_after = self.connectionRetryDelay(query, attempt)
+                if retry_after is None:
+                    raise
+
+            self.startRetry(query, variables, started, attempt, retry_after)
+            time.sleep(retry_after)
+            attempt = attempt + 1
+            call['retries'] = attempt
+
 
-    def waitForIdle(self):
-        jobStatus = self.getStatus()
-        if jobStatus['status']!="Idle":  #Check that the DB is not locked
-            print("Stash is busy.  Retrying in 10 seconds.  Status:"+jobStatus['status']+"; Progress:"+'{:.0%}'.format(jobStatus['progress']))
-            time.sleep(10)
-            self.waitForIdle()
+    def waitForIdle(self, max_age = 0, max_wait = None):  # Returns True once Stash is Idle. An Idle status seen less than max_age seconds ago is reused.  Gives up and returns False after max_wait seconds, if set
+        if time.time() - self.idle_checked_at < max_age:
+            return True
+        started = time.time()
+        delay = self.idle_poll_min
+        while True:
+            jobStatus = self.getStatus()
+            if jobStatus['status']=="Idle":  #Check that the DB is not locked
+                self.idle_checked_at = time.time()
+                return True
+            if max_wait is not None and time.time() - started >= max_wait:
+                logging.warning("Stash is still busy after "+str(max_wait)+" seconds.  Status:"+jobStatus['status'])
+                return False
+            sleep_time = delay + random.uniform(0, delay / 2)  #Jitter, so several scripts don't poll in lockstep
+            print("Stash is busy.  Retrying in {:.0f} seconds.  Status:".format(sleep_time)+jobStatus['status']+"; Progress:"+'{:.0%}'.format(jobStatus['progress'] or 0))
+            time.sleep(sleep_time)
+            delay = min(delay * 2, self.idle_poll_max)
     
     def getStatus(self): 
         query = """
@@ -191,7 +914,7 @@ class stash_interface:
         """
         result = self.callGraphQL(query)
 
-    def generate(self, generateInput = None): 
+    def generate(self, generateInput = None, scene_ids = None, paths = None):  # Generates for the whole library, or only for scene_ids and the scenes under paths, if either is given (even if empty)
         if generateInput:
             variables = generateInput
         else:
@@ -202,6 +925,14 @@ class stash_interface:
                 'markers': True,
                 'transcodes': False
                 }}
+        if scene_ids is not None or paths is not None:
+            scene_ids = list(scene_ids or [])
+            for path in paths or []:
+                scene_ids.extend(self.getSceneIDsByPath(path))
+            variables = self.scopeJobInput(variables, 'sceneIDs', scene_ids, self.getInputFields("GenerateMetadataInput"))
+            if variables is None:
+                print("No scenes to generate.")
+                return
         
         query = """
             mutation metadataGenerate($input:GenerateMetadataInput!) {
@@ -210,7 +941,7 @@ class stash_interface:
         """
         result = self.callGraphQL(query, variables)
 
-    def autoTag(self, autoTagInput= None):
+    def autoTag(self, autoTagInput= None, scene_ids = None, paths = None):  # Auto tags the whole library, or only scene_ids and the files under paths, if either is given (even if empty)
         if autoTagInput:
             variables = autoTagInput
         else:
@@ -219,6 +950,14 @@ class stash_interface:
                 'studios': ['*'],
                 'tags': ['*']
                 }}
+        if scene_ids is not None or paths is not None:
+            paths = list(paths or [])
+            if scene_ids:
+                paths.extend(scene["path"] for scene in self.iterScenes(scene_ids=[int(scene_id) for scene_id in scene_ids], fields="id path"))
+            variables = self.scopeJobInput(variables, 'paths', paths, self.getInputFields("AutoTagMetadataInput"))
+            if variables is None:
+                print("No scenes to auto tag.")
+                return
 
         query = """
             mutation metadataAutoTag($input:AutoTagMetadataInput!) {
@@ -227,6 +966,12 @@ class stash_interface:
         """
         result = self.callGraphQL(query, variables)
 
+    def getSceneIDsByPath(self, path):  # IDs of the scenes under the directory path
+        if 'path' in self.getSceneFilterFields():
+            return [scene["id"] for scene in self.iterScenes(path=path, fields="id")]
+        path = directoryPath(path)
+        return [scene["id"] for scene in self.iterScenes(fields="id path") if path in scene["path"]]
+
     def checkVersion(self):
         query = """
     {
@@ -237,11 +982,23 @@ class stash_interface:
     }
     """
         result = self.callGraphQL(query)
-        self.version_buildtime = datetime.strptime(result["data"]["version"]["build_time"], '%Y-%m-%d %H:%M:%S')
-        if self.version_buildtime < stash_interface.min_buildtime:
-            logging.error("Your Stash version appears too low to use this script.  Please upgrade to the latest \"development\" build and try again.", exc_info=self.debug_mode)
+        if not self.checkBuildTime(result["data"]["version"]):
             sys.exit()
 
+    def getInputFields(self, type_name):  # Names of the fields this Stash accepts in an input type, e.g. whether SceneFilterType supports AND/OR/NOT
+        if type_name not in self.input_fields:
+            query = "{ __type(name: \""+type_name+"\"){ inputFields { name } } }"
+            try:
+                result = self.callGraphQL(query)
+                self.input_fields[type_name] = [field["name"] for field in result["data"]["__type"]["inputFields"]]
+            except Exception:
+                logging.warning("Could not read the fields of "+type_name+" supported by Stash", exc_info=self.debug_mode)
+                self.input_fields[type_name] = []
+        return self.input_fields[type_name]
+
+    def getSceneFilterFields(self):
+        return self.getInputFields("SceneFilterType")
+
     def populatePerformers(self):  
         stashPerformers =[]
         query = """
@@ -255,12 +1012,12 @@ class stash_interface:
       }
     }
     """
+        fingerprint = self.getFingerprint('performers')
         result = self.callGraphQL(query)
         stashPerformers = result["data"]["allPerformers"]
-        for performer in stashPerformers:
-            if isinstance(performer['aliases'], str): performer['aliases'] = [alias.strip() for alias in performer['aliases'].split(',')] #Convert comma delimited string to list
         
-        self.performers = stashPerformers
+        self.setCollection('performers', stashPerformers, fingerprint)
+        self.saveSnapshot()
 
     def populateStudios(self):
         stashStudios = []
@@ -275,8 +1032,10 @@ class stash_interface:
       }
     }
     """ 
+        fingerprint = self.getFingerprint('studios')
         result = self.callGraphQL(query)
-        self.studios = result["data"]["allStudios"]
+        self.setCollection('studios', result["data"]["allStudios"], fingerprint)
+        self.saveSnapshot()
 
     def populateTags(self):
         stashTags = []
@@ -289,94 +1048,137 @@ class stash_interface:
       }
     }
     """
+        fingerprint = self.getFingerprint('tags')
         result = self.callGraphQL(query)
-        self.tags = result["data"]["allTags"]  
+        self.setCollection('tags', result["data"]["allTags"], fingerprint)
+        self.saveSnapshot()
 
-    def findScenes(self, **kwargs):
-        stashScenes =[]
-        variables = {}
-        max_scenes = kwargs.get("max_scenes", None)
-        accepted_variables = {'filter':'FindFilterType!','scene_filter': 'SceneFilterType!','scene_ids':'[Int!]'}
+    def loadCollection(self, collection):  # Makes sure 'performers', 'studios' or 'tags' are loaded, from the snapshot if it's still valid, otherwise from Stash
+        if getattr(self, collection) is not None:
+            return
+        if self.__loadFromSnapshot(collection):
+            return
+        if collection == 'performers': self.populatePerformers()
+        elif collection == 'studios': self.populateStudios()
+        elif collection == 'tags': self.populateTags()
 
-        variables['filter'] = {} #Add filter to support pages, if necessary
-                
-        #Add accepted variables to our passsed variables
-        for index, (accepted_variable, variable_type) in enumerate(accepted_variables.items()):
-            if accepted_variable in kwargs:
-                variables[accepted_variable] = kwargs[accepted_variable]
+    def getCount(self, collection):  # Number of performers, studios or tags in Stash, without downloading them
+        find_query = self.collection_queries[collection]
+        query = "{ "+find_query+"(filter: {per_page: 1}){ count } }"
+        return self.callGraphQL(query)["data"][find_query]["count"]
 
-        #Set page and per_page, if not set
-        variables['filter'] = variables.get('filter', {})
-        variables['filter']['page'] = variables['filter'].get('page', 1)
-        if max_scenes:
-            variables['filter']['per_page'] = variables['filter'].get('per_page',  min(100, max_scenes))
-        else:
-            variables['filter']['per_page'] = variables['filter'].get('per_page',  100)
-            
-        #Build our query string (e.g., "findScenes(filter:FindFilterType!){" )
-        query_string = "query("+", ".join(":".join(("$"+str(k),accepted_variables[k])) for k,v in variables.items())+'){'
+    def getFingerprints(self, collections):  # Collection -> fingerprint from Stash, in one cheap query; see buildFingerprintQuery
+        return self.parseFingerprints(collections, self.callGraphQL(self.buildFingerprintQuery(collections))["data"])
 
-        #Build our findScenes string
-        findScenes_string = "findScenes("+", ".join(":".join((str(k),"$"+str(k))) for k,v in variables.items())+'){'
+    def getFingerprint(self, collection):  # None if Stash couldn't give us one, so a collection loaded without it is never taken to be current
+        try:
+            return self.getFingerprints([collection])[collection]
+        except Exception:
+            logging.warning("Could not get a fingerprint of "+collection+" from Stash", exc_info=self.debug_mode)
+            return None
+
+    def __loadFromSnapshot(self, collection):
+        if not self.hasSnapshot(collection):
+            return False
+        fingerprint = self.getFingerprint(collection)
+        return fingerprint is not None and self.restoreSnapshot(collection, fingerprint)
 
+    def reconcileCache(self):  # Cheap staleness check: compares the fingerprints of the cached lists with Stash and only re-downloads the lists that differ
+        loaded = [collection for collection in ('performers', 'studios', 'tags') if getattr(self, collection) is not None]
+        if not loaded:
+            return False
         try:
-            query = query_string+findScenes_string+"""
-                count
-                scenes{
-                  id
-                  title
-                  oshash
-                  details
-                  url
-                  date
-                  rating
-                  path
-                  studio {
-                    id
-                    name
-                    }
-                  gallery
-                    {
-                        id
-                    }
-                  movies
-                    {
-                        movie 
-                        {
-                            id
-                        }
-                    scene_index
-                    }
-                  performers
-                    {
-                        name
-                        id
-                    }
-                  tags
-                    {
-                        name
-                        id
-                    }
-                }
-              }
-            }
-            """
-            result = self.callGraphQL(query, variables)
+            fingerprints = self.getFingerprints(loaded)
+            stale = [collection for collection in loaded if not self.isCurrent(collection, fingerprints[collection])]
+        except Exception:
+            logging.warning("Could not get fingerprints from Stash; reloading performers, studios, and tags", exc_info=self.debug_mode)
+            stale = loaded
+        populate = {'performers': self.populatePerformers, 'studios': self.populateStudios, 'tags': self.populateTags}
+        for collection in stale:
+            populate[collection]()
+        return len(stale) > 0
 
-            stashScenes = result["data"]["findScenes"]["scenes"]
-            if not max_scenes: max_scenes = result["data"]["findScenes"]["count"]
-            total_pages = math.ceil(max_scenes / variables['filter']['per_page'])
-            print("Getting Stash Scenes Page: "+str(variables['filter']['page'])+" of "+str(total_pages))
-            if (variables['filter']['page'] < total_pages and len(stashScenes)<max_scenes):  #If we're not at the last page or max_scenes, recurse with page +1 
-                variables['filter']['page'] = variables['filter']['page']+1
-                stashScenes = stashScenes+self.findScenes(**variables)
+    def findScenes(self, **kwargs):
+        return list(self.iterScenes(**kwargs))
 
-        except:
+    def iterScenes(self, **kwargs):  # Yields scenes as each page arrives.  Accepts the same arguments as findScenes, plus prefetch: the number of pages to fetch ahead concurrently.  See scene_pager for how paging copes with scenes updated along the way
+        prefetch = kwargs.get("prefetch", 0)
+        query, variables = self.buildFindScenes(kwargs)
+        pager = self.buildScenePager(kwargs, variables)
+        pending = collections.deque()  # (page, per_page, request) in page order
+        executor = ThreadPoolExecutor(max_workers=prefetch) if prefetch > 0 else None
+        try:
+            while True:
+                if not pending:
+                    pending.append(self.__requestScenePage(executor, query, variables, *pager.takePage()))
+                page, page_size, request = pending.popleft()
+                result, elapsed = request.result() if executor else request()
+                stashScenes = pager.readPage(page, page_size, result)
+                for scene in pager.newScenes(stashScenes):
+                    yield scene
+                if pager.reachedMax():
+                    return
+                if pager.pageDone(page, page_size, len(stashScenes) == 0, elapsed):
+                    self.__cancelRequests(pending)
+                if pager.isFinished(len(pending)):
+                    return
+
+                #Keep up to prefetch pages in flight
+                while executor and len(pending) < prefetch and pager.canPrefetch():
+                    pending.append(self.__requestScenePage(executor, query, variables, *pager.takePage()))
+        except Exception:
             logging.error("Unexpected error getting stash scene:", exc_info=self.debug_mode)
-            
-        return stashScenes  
+        finally:
+            if executor:
+                self.__cancelRequests(pending)
+                executor.shutdown(wait=False)
+
+    def __requestScenePage(self, executor, query, variables, page, per_page):  # Returns (page, per_page, request), where request is a future, or a callable if we're not prefetching
+        page_variables = dict(variables)
+        page_variables['filter'] = dict(variables['filter'], page=page, per_page=per_page)
+        if executor:
+            return page, per_page, executor.submit(self.__fetchScenePage, query, page_variables)
+        return page, per_page, functools.partial(self.__fetchScenePage, query, page_variables)
+
+    def __fetchScenePage(self, query, variables):
+        start = time.time()
+        result = self.callGraphQL(query, variables)
+        return result, time.time() - start
+
+    def __cancelRequests(self, pending):
+        for page, per_page, request in pending:
+            if hasattr(request, "cancel"): request.cancel()
+        pending.clear()
         
+    def enableWriteBehind(self, batch_size = 50, max_delay = 30):  # Queue scene updates and send them batch_size at a time (or once the oldest has waited max_delay seconds) in a single request
+        self.scene_update_batch_size = batch_size
+        self.scene_update_max_delay = max_delay
+        self.scene_update_queue = []
+        atexit.register(self.flushSceneUpdates)  # Don't lose queued updates if we exit early
+
+    def hydrateScene(self, scene):  # Returns the full data (SCENE_FIELDS) for a scene that was listed with fewer fields
+        return self.hydrateScenes([scene])[0]
+
+    def hydrateScenes(self, scenes):  # Returns the full data (SCENE_FIELDS) for scenes that were listed with fewer fields, fetching all that need it in one request
+        scene_ids = [scene['id'] for scene in scenes if self.needsHydrating(scene)]
+        if not scene_ids:
+            return list(scenes)
+        return self.hydratedScenes(scenes, self.callGraphQL(*self.buildHydrateScenes(scene_ids)))
+
     def updateSceneData(self, scene_data):
+        if self.scene_update_batch_size > 1:
+            with self.scene_update_lock:
+                self.scene_update_queue.append(scene_data)
+                if len(self.scene_update_queue) >= self.scene_update_batch_size or self.scene_update_max_delay <= 0:
+                    self.flushSceneUpdates()
+                elif self.scene_update_timer is None:  # The first queued update starts the clock
+                    self.scene_update_timer = threading.Timer(self.scene_update_max_delay, self.flushSceneUpdates)
+                    self.scene_update_timer.daemon = True
+                    self.scene_update_timer.start()
+            return
+        self.__updateScene(scene_data)
+
+    def __updateScene(self, scene_data):
         query = """
     mutation sceneUpdate($input:SceneUpdateInput!) {
       sceneUpdate(input: $input){
@@ -387,6 +1189,33 @@ class stash_interface:
 
         variables = {'input': scene_data}
         result = self.callGraphQL(query, variables)
+
+    def flushSceneUpdates(self):  # Sends queued scene updates as one mutation with an aliased sceneUpdate per scene.  Updates queued meanwhile wait until it's done, so each scene's updates are sent in order
+        with self.scene_update_lock:
+            if self.scene_update_timer is not None:
+                self.scene_update_timer.cancel()
+                self.scene_update_timer = None
+            queue = self.scene_update_queue
+            self.scene_update_queue = []
+            if not queue:
+                return
+            if len(queue) == 1:
+                return self.__updateScenesIndividually(queue)
+
+            query, variables = self.buildSceneUpdates(queue)
+            try:
+                result = self.callGraphQL(query, variables)
+                self.logSceneUpdateErrors(queue, result)
+            except Exception:
+                logging.error("Error sending batch of "+str(len(queue))+" scene updates.  Retrying them one at a time.", exc_info=self.debug_mode)
+                return self.__updateScenesIndividually(queue)
+
+    def __updateScenesIndividually(self, queue):
+        for scene_data in queue:
+            try:
+                self.__updateScene(scene_data)
+            except Exception:
+                logging.error("Error updating scene "+str(scene_data.get("id", None)), exc_info=self.debug_mode)
         
     def addPerformer(self, performer_data):
         result = None
@@ -398,6 +1227,9 @@ class stash_interface:
     mutation performerCreate($input:PerformerCreateInput!) {
       performerCreate(input: $input){
         id 
+        name
+        aliases
+        image_path
       }
     }
     """
@@ -405,7 +1237,7 @@ class stash_interface:
         
         try:
             result = self.callGraphQL(query, variables)
-            self.populatePerformers()
+            self.cachePerformer(result["data"]["performerCreate"])
             return result["data"]["performerCreate"]["id"]
 
         except:
@@ -414,19 +1246,16 @@ class stash_interface:
             logging.error(result)
 
     def getPerformerImage(self, url):  #UNTESTED
-        if self.http_auth_type == "basic":
-            return base64.b64encode(requests.get(url,proxies=self.proxies, auth=requests.auth.HTTPBasicAuth(self.username, self.password), 
-                                verify= not self.ignore_ssl_warnings).content)
-        elif self.http_auth_type == "jwt":
-            return base64.b64encode(requests.get(url,proxies=self.proxies, headers=self.headers, cookies={'session':self.auth_token}, verify= not self.ignore_ssl_warnings).content)
-        else:
-            return base64.b64encode(requests.get(url,proxies=self.proxies, verify= not self.ignore_ssl_warnings).content)        
+        return base64.b64encode(self.session.get(url, proxies=self.proxies, headers=self.headers).content)
         
     def addStudio(self, studio_data):
         query = """
         mutation studioCreate($input:StudioCreateInput!) {
           studioCreate(input: $input){
             id       
+            name
+            url
+            image_path
           }
         }
         """
@@ -434,7 +1263,7 @@ class stash_interface:
         variables = {'input': studio_data}
         try:
             result = self.callGraphQL(query, variables)
-            self.populateStudios()
+            self.cacheStudio(result["data"]["studioCreate"])
             return result["data"]["studioCreate"]["id"]
         except Exception as e:
             logging.error("Error in adding studio:", exc_info=self.debug_mode)
@@ -445,6 +1274,7 @@ class stash_interface:
         mutation tagCreate($input:TagCreateInput!) {
           tagCreate(input: $input){
             id       
+            name
           }
         }
         """
@@ -452,7 +1282,7 @@ class stash_interface:
 
         try:
             result = self.callGraphQL(query, variables)
-            self.populateTags()
+            self.cacheTag(result["data"]["tagCreate"])
             return result["data"]["tagCreate"]["id"]
         except Exception as e:
             logging.error("Error in adding tags", exc_info=self.debug_mode)
@@ -550,9 +1380,10 @@ class stash_interface:
     """
         variables = {'input': update_data}
         result = self.callGraphQL(query, variables)
+        self.recachePerformer(result["data"]["performerUpdate"])
         return result["data"]["performerUpdate"]
 
-    
+
     def scrapePerformerFreeones(self, name):
         query = """   
         {
@@ -577,45 +1408,20 @@ class stash_interface:
         except Exception as e:
             logging.error("Error in scraping Freeones", exc_info=self.debug_mode)
             logging.error(variables)
-        
-    def __getPerformerByName(self, name, check_aliases = False):  # A private function that allows disabling of checking for aliases
-        
-        for performer in self.performers:
-            if performer['name'].lower() == name: # Check input name against performer name
-                return performer
-            elif check_aliases and keyIsSet(performer, "aliases"):  # Check input name against performer aliases
-                performer_aliases_lower = listToLower(performer["aliases"])
-                if name in performer_aliases_lower:
-                    return performer
-    
+
     def getPerformerByName(self, name, aliases = []):
-        name = name.lower()
-        input_aliases_lower = listToLower(aliases)
-        
-        result = self.__getPerformerByName(name, True)
-        if result:  # This matches input name with existing name or alias 
-            return result
-        
-        for input_alias in input_aliases_lower: # For each alias, recurse w/ name = alias, but disable alias to alias mapping
-            result = self.__getPerformerByName(input_alias, False)
-            if result:
-                return result
-        
-        return None            
+        self.loadCollection('performers')
+        return self.findCachedPerformer(name, aliases)
 
     def getStudioByName(self, name):
-        for studio in self.studios:
-            if studio['name'].lower().strip() == name.lower().strip():
-                return studio
-        return None
+        self.loadCollection('studios')
+        return self.findCachedStudio(name)
     
     def getTagByName(self, name, add_tag_if_missing = False):
-        logging.debug("Getting tag id for tag \'"+name+"\'.")
-        search_name = name.lower().replace('-', ' ').replace('(', '').replace(')', '').strip().replace(' ', '')
-        for tag in self.tags:
-            if search_name == tag['name'].lower().replace('-', ' ').replace('(', '').replace(')', '').strip().replace(' ', ''):
-                logging.debug("Found the tag.  ID is "+tag['id'])
-                return tag
+        self.loadCollection('tags')
+        tag = self.findCachedTag(name)
+        if tag:
+            return tag
         
         # Add the Tag to Stash
         if add_tag_if_missing:
@@ -626,41 +1432,7 @@ class stash_interface:
             return self.getTagByName(name)
 
         return None
-
-    def createSceneUpdateData(self, scene_data):  #Scene data returned from stash has a different format than what is accepted by the UpdateScene graphQL query.  This converts one format to another
-        scene_update_data = {}
-        if keyIsSet(scene_data, "id"): scene_update_data["id"] = scene_data["id"]
-        if keyIsSet(scene_data, "title"): scene_update_data["title"] = scene_data["title"]
-        if keyIsSet(scene_data, "details"): scene_update_data["details"] = scene_data["details"]
-        if keyIsSet(scene_data, "url"): scene_update_data["url"] = scene_data["url"]
-        if keyIsSet(scene_data, "date"): scene_update_data["date"] = scene_data["date"]
-        if keyIsSet(scene_data, "rating"): scene_update_data["rating"] = scene_data["rating"]
-        if keyIsSet(scene_data, "studio"): scene_update_data["studio_id"] = scene_data["studio"]["id"]
-        if keyIsSet(scene_data, "gallery"): scene_update_data["gallery_id"] = scene_data["gallery"]["id"]
-        if keyIsSet(scene_data, "movies"):
-            scene_update_data["movies"] = []
-            for entry in scene_data["movies"]:
-                update_date_movie = {}
-                update_date_movie["movie_id"]=entry["movie"]["id"]
-                update_date_movie["scene_index"]=entry["scene_index"]
-                scene_update_data["movies"].append(update_date_movie)
-        else:
-            scene_update_data["movies"] = []
         
-        if keyIsSet(scene_data, "performers"):
-            scene_update_data["performer_ids"] = []
-            for performer in scene_data["performers"]:
-                scene_update_data["performer_ids"].append(performer["id"])
-        else:
-            scene_update_data["performer_ids"] = []
-        if keyIsSet(scene_data, "tags"):
-            scene_update_data["tag_ids"] = []
-            for tag in scene_data["tags"]:
-                scene_update_data["tag_ids"].append(tag["id"])
-        else:
-            scene_update_data["tag_ids"] = []
-        return scene_update_data
-
 class config_class:
     ###############################################
     # DEFAULT CONFIGURATION OPTIONS.  DO NOT EDIT #
@@ -736,7 +1508,12 @@ def parseArgs(args):
                        '--path',
                        nargs='+',
                        action='store',
-                       help='path for scans')
+                       help='path for scans; also limits generate and auto tag to the scenes under these paths')
+    my_parser.add_argument('-i',
+                       '--scene_ids',
+                       nargs='+',
+                       action='store',
+                       help='limit generate and auto tag to these scene IDs')
     my_parser.add_argument('-c',
                        '--clean',
                        action='store_true',
@@ -793,7 +1570,7 @@ def main(args):
         if args.generate: 
             print("Generating...")
             my_stash.waitForIdle()
-            my_stash.generate()
+            my_stash.generate(scene_ids=args.scene_ids, paths=args.path)
         if args.clean: 
             print("Cleaning...")
             my_stash.waitForIdle()
@@ -809,7 +1586,7 @@ def main(args):
             if 's' in args.auto_tag: variables["input"]['studios'] = ['*']
             if 't' in args.auto_tag: variables["input"]['tags'] = ['*']
             my_stash.waitForIdle()
-            my_stash.autoTag()
+            my_stash.autoTag(variables, scene_ids=args.scene_ids, paths=args.path)
         if args.wait:
             my_stash.waitForIdle()
         print("Success! Finished.")
@@ -0,0 +1,134 @@
+import requests
+import HttpTransport
+import logging
+import threading
+import time
+import random
+
+class tpbd_unavailable(Exception):  # ThePornDB kept failing for longer than max_outage_seconds
+    pass
+
+class tpbd_stopped(Exception):  # Raised by requests made after tpbd_client.stop()
+    pass
+
+class tpbd_client:  # Paces requests to ThePornDB with a token bucket shared by every thread.  429 responses halve the rate (it recovers gradually with successful requests), and repeated failures pause all requests, rather than giving up, until ThePornDB has been down for max_outage_seconds
+    failure_threshold = 3  # Consecutive failures before we pause
+    retry_base_delay = 1
+    max_pause_seconds = 900
+
+    def __init__(self, transport = None, requests_per_second = 2, burst = 5, outage_pause_seconds = 30, max_outage_seconds = 3600):
+        self.transport = transport or HttpTransport.http_transport()
+        self.max_rate = requests_per_second  # 0 for no limit
+        self.rate = requests_per_second
+        self.burst = max(1, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.outage_pause_seconds = outage_pause_seconds
+        self.max_outage_seconds = max_outage_seconds
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()  # Set by stop()
+        self.paused_until = 0  # time.monotonic() before which no request is sent
+        self.pause_seconds = outage_pause_seconds  # Doubles each time ThePornDB is still down after a pause
+        self.consecutive_failures = 0
+        self.outage_started = None
+        self.stats = {'requests': 0, 'throttled': 0, 'failures': 0, 'pauses': 0, 'wait_seconds': 0.0}
+
+    def acquire(self):  # Waits for a pause to end and for a token
+        while True:
+            if self.stopped.is_set():
+                raise tpbd_stopped("Requests to ThePornDB were stopped")
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if not self.rate:
+                        return
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens = self.tokens - 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                self.stats['wait_seconds'] = self.stats['wait_seconds'] + wait
+            self.stopped.wait(wait)
+
+    def stop(self):  # Makes requests waiting for a pause or a token, and any made after, raise tpbd_stopped, e.g. so worker threads return promptly when we're interrupted
+        self.stopped.set()
+
+    def getJson(self, url):  # GETs url and returns (parsed JSON, response).  Non-JSON responses other than errors from ThePornDB itself raise ValueError
+        attempt = 0
+        while True:
+            self.acquire()
+            try:
+                response = self.transport.get(url)
+            except requests.exceptions.RequestException as e:
+                self.failed(attempt, e.__class__.__name__)
+                attempt = attempt + 1
+                continue
+            with self.lock:
+                self.stats['requests'] = self.stats['requests'] + 1
+            if response.status_code == 429:
+                self.throttled(attempt, response.headers.get('Retry-After', None))
+                attempt = attempt + 1
+                continue
+            if response.status_code >= 500:
+                self.failed(attempt, "HTTP "+str(response.status_code))
+                attempt = attempt + 1
+                continue
+            try:
+                result = response.json()
+            except ValueError:
+                if response.status_code != 200:  # e.g., a 404 page
+                    raise
+                self.failed(attempt, "a response that wasn't JSON")
+                attempt = attempt + 1
+                continue
+            self.succeeded()
+            return result, response
+
+    def retryDelay(self, attempt):
+        delay = min(self.retry_base_delay * 2 ** attempt, self.max_pause_seconds)
+        return delay + random.uniform(0, delay / 2)
+
+    def throttled(self, attempt, retry_after):
+        delay = HttpTransport.parseRetryAfter(retry_after)
+        if delay is None:
+            delay = self.retryDelay(attempt)
+        with self.lock:
+            self.stats['throttled'] = self.stats['throttled'] + 1
+            if self.rate:
+                self.rate = max(self.max_rate / 16, self.rate / 2)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        logging.debug("ThePornDB is rate limiting us; waiting {:.1f} seconds and slowing to {:.2f} requests per second".format(delay, self.rate))
+
+    def failed(self, attempt, error):
+        with self.lock:
+            now = time.monotonic()
+            self.stats['failures'] = self.stats['failures'] + 1
+            self.consecutive_failures = self.consecutive_failures + 1
+            if self.outage_started is None:
+                self.outage_started = now
+            if now - self.outage_started > self.max_outage_seconds:
+                raise tpbd_unavailable("ThePornDB has been failing for {:.1f} minutes (last error: {})".format((now - self.outage_started) / 60, error))
+            if now < self.paused_until:  # Sent before the pause started; just wait it out
+                return
+            if self.consecutive_failures < self.failure_threshold:
+                self.paused_until = now + self.retryDelay(attempt)
+                return
+            pause = self.pause_seconds
+            self.pause_seconds = min(self.pause_seconds * 2, self.max_pause_seconds)
+            self.paused_until = now + pause
+            self.stats['pauses'] = self.stats['pauses'] + 1
+        logging.warning("Error communicating with ThePornDB ({}).  It seems to be down; pausing for {:.0f} seconds.".format(error, pause))
+
+    def succeeded(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.outage_started = None
+            self.pause_seconds = self.outage_pause_seconds
+            if self.rate < self.max_rate:  # Creep back up after being throttled
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def getStats(self):
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,44 @@
+# Compares the memory used by cached Stash performers, studios, and tags as raw JSON dicts vs. the slotted records stash_interface keeps.
+# Uses synthetic data, so no Stash server is needed.  Run from the repository root: python benchmarks/cache_memory.py [performer count]
+import os
+import sys
+import json
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import StashInterface
+
+def syntheticData(performer_count):
+    performers = []
+    for i in range(performer_count):
+        aliases = ", ".join("Alias {} {}".format(i % 5000, n) for n in range(i % 4)) or None
+        performers.append({'id': str(i), 'name': "Performer {}".format(i), 'aliases': aliases, 'image_path': "http://stash:9999/performer/{}/image".format(i)})
+    studios = [{'id': str(i), 'name': "Studio {}".format(i), 'url': "https://studio{}.example.com".format(i), 'image_path': None} for i in range(performer_count // 20)]
+    tags = [{'id': str(i), 'name': "Tag {}".format(i)} for i in range(performer_count // 10)]
+    return json.dumps({'performers': performers, 'studios': studios, 'tags': tags})  # Parsed inside each measurement, like a GraphQL response
+
+def measure(label, build, raw_json):
+    tracemalloc.start()
+    cache = build(json.loads(raw_json))
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print("{:<16} {:>10.1f} MB resident {:>10.1f} MB peak".format(label, current / 2**20, peak / 2**20))
+    return cache
+
+def buildDicts(data):  # What stash_interface used to keep: the JSON dicts, with aliases split into lists
+    for performer in data['performers']:
+        StashInterface.splitAliases(performer)
+    return data['performers'], data['studios'], data['tags']
+
+def buildRecords(data):
+    performers = [StashInterface.stash_performer(performer) for performer in data.pop('performers')]
+    studios = [StashInterface.stash_studio(studio) for studio in data.pop('studios')]
+    tags = [StashInterface.stash_tag(tag) for tag in data.pop('tags')]
+    return performers, studios, tags
+
+if __name__ == "__main__":
+    performer_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    raw_json = syntheticData(performer_count)
+    print("{} performers, {} studios, {} tags".format(performer_count, performer_count // 20, performer_count // 10))
+    measure("JSON dicts", buildDicts, raw_json)
+    measure("Slotted records", buildRecords, raw_json)
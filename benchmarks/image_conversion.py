@@ -0,0 +1,72 @@
+# Compares converting images for Stash the old way (always decode at full size and re-encode as JPEG) with convertToJpeg (JPEG passthrough, draft-mode decoding to image_max_dimension).
+# Run from the repository root: python benchmarks/image_conversion.py [image folder] [max dimension]
+# Without an image folder, synthetic covers, logos, and performer images are generated in a temporary folder, so no network is needed.
+import os
+import sys
+import time
+import tempfile
+from io import BytesIO
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import scrapeScenes
+
+def oldConvert(data):  # What getJpegBuffer used to do
+    image = Image.open(BytesIO(data))
+    image.load()
+    if image.mode in ('RGBA', 'LA'):
+        background = Image.new(image.mode[:-1], image.size, 'black')
+        background.paste(image, image.split()[-1])
+        image = background
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+def syntheticImages(folder):
+    samples = [("cover_1080p.jpg", (1920, 1080), 'RGB', "JPEG"), ("cover_4k.jpg", (3840, 2160), 'RGB', "JPEG"), ("cover_small.jpg", (640, 360), 'RGB', "JPEG"),
+               ("performer.jpg", (1000, 1500), 'RGB', "JPEG"), ("logo.png", (800, 200), 'RGBA', "PNG"), ("poster.png", (1200, 1800), 'RGB', "PNG")]
+    for name, size, mode, image_format in samples:
+        image = Image.new(mode, size, 'white')
+        draw = ImageDraw.Draw(image)
+        for i in range(0, size[0], 16):  # Some detail, so JPEG encoding isn't trivially cheap
+            draw.line([(i, 0), (size[0] - i, size[1])], fill=(i % 256, (i * 3) % 256, (i * 7) % 256), width=3)
+        image.save(os.path.join(folder, name), format=image_format, quality=90)
+
+def loadImages(folder):
+    images = []
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), 'rb') as f:
+            data = f.read()
+        try:
+            Image.open(BytesIO(data))
+        except Exception:
+            continue  # Not an image
+        images.append((name, data))
+    return images
+
+def measure(label, convert, images, rounds):
+    start = time.perf_counter()
+    for i in range(rounds):
+        outputs = [convert(data) for name, data in images]
+    seconds = (time.perf_counter() - start) / rounds
+    output_bytes = sum(len(output) for output in outputs)
+    unchanged = sum(1 for (name, data), output in zip(images, outputs) if output == data)
+    print("{:<28} {:>8.1f} ms per batch {:>10.1f} KB out {:>4} passed through".format(label, seconds * 1000, output_bytes / 1024, unchanged))
+
+if __name__ == "__main__":
+    max_dimension = int(sys.argv[2]) if len(sys.argv) > 2 else 1280
+    temp_folder = None
+    if len(sys.argv) > 1:
+        folder = sys.argv[1]
+    else:
+        temp_folder = tempfile.TemporaryDirectory()
+        folder = temp_folder.name
+        syntheticImages(folder)
+    images = loadImages(folder)
+    rounds = 3
+    print("{} images, {:.1f} KB in, from {}".format(len(images), sum(len(data) for name, data in images) / 1024, folder))
+    measure("Decode and re-encode", oldConvert, images, rounds)
+    measure("JPEG passthrough", lambda data: scrapeScenes.convertToJpeg(data), images, rounds)
+    measure("Max dimension "+str(max_dimension), lambda data: scrapeScenes.convertToJpeg(data, max_dimension), images, rounds)
+    if temp_folder:
+        temp_folder.cleanup()
@@ -0,0 +1,113 @@
+# Paging through scenes while the caller updates them so they drop out of the filter, the way scrapeScenes does by adding the scrape or unmatched tag.
+# Run from the repository root: python -m pytest tests
+import asyncio
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from StashInterface import stash_interface, stash_interface_base
+import AsyncStashInterface
+
+PER_PAGE = 10
+
+class fake_library:  # Scenes 1 to size, minus the ones the caller has excluded (i.e., tagged)
+    def __init__(self, size):
+        self.scene_ids = [str(i) for i in range(1, size + 1)]
+        self.excluded = set()
+        self.lock = threading.Lock()
+
+    def findScenes(self, variables):
+        page = variables['filter']['page']
+        per_page = variables['filter']['per_page']
+        with self.lock:
+            remaining = [scene_id for scene_id in self.scene_ids if scene_id not in self.excluded]
+        return {'data': {'findScenes': {'count': len(remaining), 'scenes': [{'id': scene_id} for scene_id in remaining[(page - 1) * per_page:page * per_page]]}}}
+
+    def exclude(self, scene_id):
+        with self.lock:
+            self.excluded.add(scene_id)
+
+class fake_stash(stash_interface):
+    def __init__(self, library, **settings):  # settings override class attributes, e.g. scene_page_seconds
+        stash_interface_base.__init__(self, "http://stash.invalid")
+        self.library = library
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    def callGraphQL(self, query, variables = None):
+        return self.library.findScenes(variables)
+
+class fake_async_stash(AsyncStashInterface.async_stash_interface):
+    def __init__(self, library, **settings):
+        AsyncStashInterface.async_stash_interface.__init__(self, "http://stash.invalid")
+        self.library = library
+        for name, value in settings.items():
+            setattr(self, name, value)
+
+    async def callGraphQL(self, query, variables = None):
+        await asyncio.sleep(0)
+        return self.library.findScenes(variables)
+
+def excludeAll(scene_id):
+    return True
+
+def excludeEveryThird(scene_id):
+    return int(scene_id) % 3 == 0
+
+class iter_scenes_test(unittest.TestCase):
+    prefetches = (0, 2, 4)
+
+    def iterate(self, library, settings, **kwargs):
+        return fake_stash(library, **settings).iterScenes(**kwargs)
+
+    def assertAllScenesReturned(self, should_exclude, sizes, settings = {}, **kwargs):
+        for prefetch in self.prefetches:
+            for size in sizes:
+                with self.subTest(prefetch=prefetch, size=size):
+                    library = fake_library(size)
+                    returned = []
+                    for scene in self.iterate(library, settings, prefetch=prefetch, **kwargs):
+                        returned.append(scene['id'])
+                        if should_exclude(scene['id']):
+                            library.exclude(scene['id'])
+                    self.assertEqual(sorted(returned, key=int), library.scene_ids)
+
+    def test_caller_excludes_every_scene(self):
+        self.assertAllScenesReturned(excludeAll, range(PER_PAGE, 2 * PER_PAGE + 1), filter={'per_page': PER_PAGE})
+
+    def test_caller_excludes_some_scenes(self):
+        self.assertAllScenesReturned(excludeEveryThird, range(PER_PAGE, 2 * PER_PAGE + 1), filter={'per_page': PER_PAGE})
+
+    def test_unchanged_library(self):
+        self.assertAllScenesReturned(lambda scene_id: False, range(PER_PAGE, 2 * PER_PAGE + 1), filter={'per_page': PER_PAGE})
+
+    # Without a per_page, the first page has 100 scenes and later pages are resized from how long it took.  A fake Stash answers instantly, so
+    # scene_page_seconds = 0 always shrinks pages to min_scene_page_size, and a large scene_page_seconds always grows them to max_scene_page_size
+    def test_pages_shrink_while_caller_excludes(self):
+        for should_exclude in (excludeAll, excludeEveryThird):
+            self.assertAllScenesReturned(should_exclude, range(100, 201), {'scene_page_seconds': 0, 'min_scene_page_size': 30})
+
+    def test_pages_grow_while_caller_excludes(self):
+        for should_exclude in (excludeAll, excludeEveryThird):
+            self.assertAllScenesReturned(should_exclude, range(100, 201), {'scene_page_seconds': 1000, 'max_scene_page_size': 150})
+
+@unittest.skipIf(AsyncStashInterface.aiohttp is None, "aiohttp is not installed")
+class async_iter_scenes_test(iter_scenes_test):
+    def iterate(self, library, settings, **kwargs):
+        stash = fake_async_stash(library, **settings)
+        loop = asyncio.new_event_loop()
+        iterator = stash.iterScenes(**kwargs)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(iterator.__anext__())
+                except StopAsyncIteration:
+                    return
+        finally:
+            loop.run_until_complete(iterator.aclose())
+            loop.close()
+
+if __name__ == "__main__":
+    unittest.main()
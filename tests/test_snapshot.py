@@ -0,0 +1,129 @@
+# Reusing performers, studios and tags saved by a previous run, and noticing when Stash has changed since.
+# Run from the repository root: python -m pytest tests
+import itertools
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from StashInterface import stash_interface, stash_interface_base
+
+class fake_collection:  # Entries with the created and updated order Stash would sort them by
+    def __init__(self, entries):
+        self.clock = itertools.count()
+        self.entries = []
+        self.next_id = 1
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        entry = dict(entry, id=str(self.next_id), created=next(self.clock))
+        entry['updated'] = entry['created']
+        self.next_id = self.next_id + 1
+        self.entries.append(entry)
+        return entry
+
+    def update(self, entry_id, **fields):
+        entry = self.find(entry_id)
+        entry.update(fields, updated=next(self.clock))
+
+    def delete(self, entry_id):
+        self.entries.remove(self.find(entry_id))
+
+    def find(self, entry_id):
+        return [entry for entry in self.entries if entry['id'] == entry_id][0]
+
+    def public(self, entry):
+        return {key: value for key, value in entry.items() if key not in ('created', 'updated')}
+
+class fake_stash(stash_interface):
+    def __init__(self, performers):
+        stash_interface_base.__init__(self, "http://stash.invalid")
+        self.fake_performers = performers
+        self.downloads = 0
+
+    def callGraphQL(self, query, variables = None):
+        if 'allPerformers' in query:
+            self.downloads = self.downloads + 1
+            return {'data': {'allPerformers': [self.fake_performers.public(entry) for entry in self.fake_performers.entries]}}
+        if 'performerCreate' in query:
+            entry = self.fake_performers.add(variables['input'])
+            return {'data': {'performerCreate': self.fake_performers.public(entry)}}
+        if 'performers_latest' in query:
+            entries = self.fake_performers.entries
+            latest = sorted(entries, key=lambda entry: entry['updated'])[-1:]
+            newest = sorted(entries, key=lambda entry: entry['created'])[-1:]
+            return {'data': {
+                'performers_latest': {'count': len(entries), 'performers': [self.fake_performers.public(entry) for entry in latest]},
+                'performers_newest': {'performers': [{'id': entry['id']} for entry in newest]}}}
+        raise ValueError("Unexpected query: "+query)
+
+class snapshot_test(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.snapshot_file = os.path.join(self.folder.name, "snapshot.json")
+        self.performers = fake_collection([{'name': 'Performer '+str(i), 'aliases': None, 'image_path': None} for i in range(5)])
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def run_once(self, max_age = 86400):  # Loads performers the way a run does, saves the snapshot as it would at exit, and returns the client
+        stash = fake_stash(self.performers)
+        stash.enableSnapshot(self.snapshot_file, max_age)
+        stash.loadCollection('performers')
+        stash.saveSnapshot(True)
+        return stash
+
+    def assertReused(self, stash):
+        self.assertEqual(stash.downloads, 0)
+
+    def assertDownloaded(self, stash):
+        self.assertEqual(stash.downloads, 1)
+        self.assertEqual([performer.name for performer in stash.performers], [entry['name'] for entry in self.performers.entries])
+
+    def test_unchanged_snapshot_is_reused(self):
+        self.assertDownloaded(self.run_once())
+        self.assertReused(self.run_once())
+
+    def test_delete_and_add_keeps_count_but_reloads(self):
+        self.run_once()
+        self.performers.delete('2')
+        self.performers.add({'name': 'Replacement', 'aliases': None, 'image_path': None})
+        self.assertDownloaded(self.run_once())
+
+    def test_rename_reloads(self):
+        self.run_once()
+        self.performers.update('3', name='Renamed')
+        self.assertDownloaded(self.run_once())
+
+    def test_alias_edit_reloads(self):
+        self.run_once()
+        self.performers.update('1', aliases='New Alias')
+        stash = self.run_once()
+        self.assertDownloaded(stash)
+        self.assertEqual(stash.getPerformerByName('New Alias')['id'], '1')
+
+    def test_our_own_additions_keep_snapshot(self):
+        stash = self.run_once()
+        stash.addPerformer({'name': 'Added By Us'})
+        stash.saveSnapshot(True)
+        stash = self.run_once()
+        self.assertReused(stash)
+        self.assertIsNotNone(stash.getPerformerByName('Added By Us'))
+
+    def test_expired_snapshot_reloads(self):
+        self.run_once()
+        time.sleep(0.01)
+        self.assertDownloaded(self.run_once(max_age=0))
+
+    def test_reconcile_cache_notices_edits(self):
+        stash = self.run_once()
+        self.assertFalse(stash.reconcileCache())
+        self.performers.update('4', name='Renamed')
+        self.assertTrue(stash.reconcileCache())
+        self.assertIsNotNone(stash.getPerformerByName('Renamed'))
+
+if __name__ == "__main__":
+    unittest.main()